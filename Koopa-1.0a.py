@@ -1,15 +1,30 @@
 import pygame
+import numpy as np
+import argparse
 import math
 import random
+import os
 import sys
-from collections import namedtuple
+import time
+import struct
+import zlib
+import mmap
+import hashlib
+import gc
+import json
+import threading
+import platform as host_platform
+import concurrent.futures
+from itertools import repeat
+from collections import namedtuple, OrderedDict
 from enum import Enum, auto
 
-# Initialize pygame
-pygame.init()
+try:
+    from pygame._sdl2 import video as sdl_video
+except ImportError:
+    sdl_video = None
+
 WIDTH, HEIGHT = 800, 500
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Paper Mario: Thousand-Year Door Engine")
 
 # Constants
 GROUND_LEVEL = HEIGHT - 60
@@ -17,11 +32,59 @@ CAMERA_SMOOTHNESS = 0.1
 GRAVITY = 0.7
 JUMP_POWER = 14
 FPS = 60
+SIM_RATE = 60
+SIM_STEP = 1.0 / SIM_RATE
+MAX_FRAME_TIME = 0.25
+MAX_STEPS_PER_FRAME = 5
+BATCH_FRAMES = 3600
+BENCH_SIZES = (1000, 10000, 100000)
+BENCH_TOLERANCE = 0.15
+BENCH_MIN_TIME = 0.05
+BENCH_NOISE_FLOOR = 0.05
+PROFILE_HISTORY = 600
+CHUNK_WIDTH = 1024
+CHUNK_MARGIN = 1
+COIN_PICKUP_RADIUS = 30
+CULL_MARGIN = 64
+RENDER_SCALES = (1.0, 0.75, 0.5, 0.25)
+RENDER_SCALE_WINDOW = 60
+RENDER_SCALE_HEADROOM = 0.8
+DIALOG_TEXT_SIZE = 22
+DIALOG_PADDING = 20
+DIALOG_LINE_HEIGHT = 26
+DIALOG_PAGE_HOLD = 180
+CHUNK_SPEC_CACHE = 64
+BOOT_LOOKAHEAD = 4
+BOOT_WARM_TICKS = 600
+PARTICLE_GRAVITY = 0.15
+PARTICLE_CAPACITY = 100000
+PARTICLE_SPLAT_RADIUS = 8
+GLYPH_CACHE_BYTES = 4 * 1024 * 1024
+TEXT_CACHE_BYTES = 16 * 1024 * 1024
+SPRITE_CACHE_BYTES = 32 * 1024 * 1024
+SCREEN_CACHE_BYTES = 16 * 1024 * 1024
+TEXTURE_CACHE_BYTES = 64 * 1024 * 1024
+PLATFORM_SPRITE_MARGIN = 16
+CLOUD_FLUFF_EXTENT = 165
+KOOPS_SPRITE_ORIGIN = (24, 64)
+GOOMBA_SPRITE_ORIGIN = (12, 4)
+COIN_SPRITE_ORIGIN = (16, 16)
 
 # Named tuples for better structure
 Color = namedtuple('Color', ['r', 'g', 'b'])
 Point = namedtuple('Point', ['x', 'y'])
 Size = namedtuple('Size', ['width', 'height'])
+Controls = namedtuple('Controls', ['dx', 'jump', 'crouch', 'run'])
+KoopsFrame = namedtuple('KoopsFrame', ['size', 'direction', 'leg_offset', 'head_bob', 'bandana_offset',
+                                       'eye_open', 'pupil_size', 'hurt', 'hit_points'])
+GoombaFrame = namedtuple('GoombaFrame', ['size', 'crushed', 'animation_offset', 'squish'])
+CoinFrame = namedtuple('CoinFrame', ['rotation', 'flash'])
+PlatformSpec = namedtuple('PlatformSpec', ['x', 'y', 'width', 'height', 'color', 'is_spike', 'is_cloud'])
+CoinSpec = namedtuple('CoinSpec', ['x', 'y'])
+GoombaSpec = namedtuple('GoombaSpec', ['x', 'y', 'walk_range'])
+LevelChunk = namedtuple('LevelChunk', ['platforms', 'coins', 'goombas'])
+
+GOOMBA_SIZE = Size(30, 20)
 
 # Color definitions
 BACKGROUND = Color(100, 160, 255)
@@ -51,15 +114,107 @@ class GameState(Enum):
     GAMEPLAY = auto()
     GAME_OVER = auto()
 
+class SurfaceCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+    @staticmethod
+    def surface_bytes(surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+    
+    def get(self, key, build):
+        surface = self.entries.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return surface
+        
+        self.misses += 1
+        surface = build()
+        self.entries[key] = surface
+        self.bytes_used += self.surface_bytes(surface)
+        
+        # Evict least recently used surfaces, but always keep the one just built
+        while self.bytes_used > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes_used -= self.surface_bytes(evicted)
+            self.evictions += 1
+        return surface
+    
+    def clear(self):
+        self.entries.clear()
+        self.bytes_used = 0
+        
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes_used,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
 class VectorFont:
+    glyph_cache = SurfaceCache(GLYPH_CACHE_BYTES)
+    text_cache = SurfaceCache(TEXT_CACHE_BYTES)
+    
+    @staticmethod
+    def padding(outline):
+        return outline + 2
+    
     @staticmethod
     def render_text(surface, text, x, y, size, color, outline_color=BLACK, outline=2):
+        text_surface = VectorFont.text_surface(text, size, color, outline_color, outline)
+        pad = VectorFont.padding(outline)
+        return surface.blit(text_surface, (x - pad, y - pad))
+        
+    @staticmethod
+    def text_surface(text, size, color, outline_color=BLACK, outline=2):
+        key = (text, size, tuple(color), tuple(outline_color), outline)
+        return VectorFont.text_cache.get(
+            key, lambda: VectorFont.build_text(text, size, color, outline_color, outline))
+    
+    @staticmethod
+    def glyph_surface(char, size, color, outline_color=BLACK, outline=2):
+        if char not in CHAR_DEFINITIONS:
+            char = '?'
+        key = (char, size, tuple(color), tuple(outline_color), outline)
+        return VectorFont.glyph_cache.get(
+            key, lambda: VectorFont.build_glyph(char, size, color, outline_color, outline))
+    
+    @staticmethod
+    def build_glyph(char, size, color, outline_color, outline):
+        pad = VectorFont.padding(outline)
+        extent = math.ceil(size) + 2 * pad
+        glyph = pygame.Surface((extent, extent), pygame.SRCALPHA)
+        VectorFont.draw_char(glyph, char, pad, pad, size, color, outline_color, outline)
+        return glyph
+    
+    @staticmethod
+    def build_text(text, size, color, outline_color, outline):
         char_width = size * 0.6
         spacing = size * 0.1
+        pad = VectorFont.padding(outline)
         
+        width = math.ceil(max(0, len(text) - 1) * (char_width + spacing) + size) + 2 * pad
+        height = math.ceil(size) + 2 * pad
+        text_surface = pygame.Surface((width, height), pygame.SRCALPHA)
         for i, char in enumerate(text):
-            char_x = x + i * (char_width + spacing)
-            VectorFont.draw_char(surface, char, char_x, y, size, color, outline_color, outline)
+            glyph = VectorFont.glyph_surface(char, size, color, outline_color, outline)
+            text_surface.blit(glyph, (round(i * (char_width + spacing)), 0))
+        return text_surface
+    
+    @staticmethod
+    def cache_stats():
+        return {
+            'glyphs': VectorFont.glyph_cache.stats(),
+            'text': VectorFont.text_cache.stats(),
+        }
     
     @staticmethod
     def draw_char(surface, char, x, y, size, color, outline_color, outline):
@@ -124,9 +279,61 @@ CHAR_DEFINITIONS = {
     '?': [[(5, 0), (25, 0), (30, 5), (30, 15), (20, 25), (15, 25)], [(15, 30), (15, 30)]]
 }
 
+def lerp(a, b, t):
+    return a + (b - a) * t
+
+def lerp_point(a, b, t):
+    return Point(lerp(a.x, b.x, t), lerp(a.y, b.y, t))
+
+class Vec2:
+    # Mutable position for moving entities, updated in place instead of allocating a Point per step
+    __slots__ = ('x', 'y')
+    
+    def __init__(self, x=0, y=0):
+        self.x = x
+        self.y = y
+        
+    def set(self, x, y):
+        self.x = x
+        self.y = y
+        
+    def copy(self):
+        return Vec2(self.x, self.y)
+    
+    def __iter__(self):
+        yield self.x
+        yield self.y
+        
+    def __getitem__(self, index):
+        return (self.x, self.y)[index]
+    
+    def __len__(self):
+        return 2
+    
+    def __eq__(self, other):
+        # Compares equal to any 2-sequence, like the tuple positions it replaced
+        try:
+            if len(other) != 2:
+                return False
+            return self.x == other[0] and self.y == other[1]
+        except (TypeError, LookupError):
+            return NotImplemented
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"Vec2(x={self.x!r}, y={self.y!r})"
+
 class Koops:
-    def __init__(self, x, y):
-        self.position = Point(x, y)
+    __slots__ = ('rng', 'position', 'previous_position', 'size', 'walking_speed', 'running_speed', 'speed',
+                 'velocity_y', 'direction', 'leg_offset', 'head_bob', 'bandana_offset', 'is_jumping',
+                 'is_grounded', 'crouching', 'running', 'hit_points', 'invincible', 'closing_eyes')
+    frame_cache = SurfaceCache(SPRITE_CACHE_BYTES)
+    
+    def __init__(self, x, y, rng=random):
+        self.rng = rng
+        self.position = Vec2(x, y)
+        self.previous_position = Vec2(x, y)
         self.size = Size(40, 50)
         self.walking_speed = 4
         self.running_speed = 6
@@ -144,55 +351,65 @@ class Koops:
         self.invincible = 0
         self.closing_eyes = 0
         
-    def update(self, platforms):
-        time = pygame.time.get_ticks() * 0.01
+    def animate(self, now):
+        time = now * 0.01
         self.leg_offset = math.sin(time) * 4
         self.head_bob = math.sin(time * 3) * 1
         self.bandana_offset = math.sin(time * 2.5) * 3
         
+    def update(self, platforms, now=None):
+        if now is None:
+            now = pygame.time.get_ticks()
+        self.animate(now)
+        
         self.velocity_y += GRAVITY
-        self.position = Point(self.position.x, self.position.y + self.velocity_y)
+        self.position.y += self.velocity_y
         
         if self.invincible > 0:
             self.invincible -= 1
         
         if self.closing_eyes > 0:
             self.closing_eyes -= 1
-        elif random.random() < 0.005:
+        elif self.rng.random() < 0.005:
             self.closing_eyes = 7
             
         self.is_grounded = False
         if self.position.y >= GROUND_LEVEL - self.size.height:
-            self.position = Point(self.position.x, GROUND_LEVEL - self.size.height)
+            self.position.y = GROUND_LEVEL - self.size.height
             self.velocity_y = 0
             self.is_grounded = True
             self.is_jumping = False
             
-        for platform in platforms:
+        feet_y = self.position.y + self.size.height
+        for platform in platforms.query(self.position.x, feet_y - 40, self.size.width, 40):
             if (self.position.x + self.size.width > platform.position.x and 
                 self.position.x < platform.position.x + platform.size.width and
                 self.position.y + self.size.height > platform.position.y and
                 self.position.y + self.size.height < platform.position.y + 20 and
                 self.velocity_y > 0):
-                self.position = Point(self.position.x, platform.position.y - self.size.height)
+                self.position.y = platform.position.y - self.size.height
                 self.velocity_y = 0
                 self.is_grounded = True
                 self.is_jumping = False
                 
-    def move(self, dx, platforms):
+    def move(self, dx, platforms, right_edge=None):
         if self.crouching:
             return
             
         self.speed = self.running_speed if self.running else self.walking_speed
         new_x = self.position.x + dx * self.speed
-        new_x = max(0, min(WIDTH - self.size.width, new_x))
+        new_x = max(0, new_x)
+        if right_edge is not None:
+            new_x = min(right_edge - self.size.width, new_x)
         
         if dx > 0:
             self.direction = 1
         elif dx < 0:
             self.direction = -1
             
-        for platform in platforms:
+        sweep_x = min(self.position.x, new_x)
+        sweep_width = abs(new_x - self.position.x) + self.size.width
+        for platform in platforms.query(sweep_x, self.position.y, sweep_width, self.size.height):
             if (new_x + self.size.width > platform.position.x and 
                 new_x < platform.position.x + platform.size.width and
                 self.position.y + self.size.height > platform.position.y and
@@ -202,7 +419,7 @@ class Koops:
                 elif dx < 0:
                     new_x = platform.position.x + platform.size.width
         
-        self.position = Point(new_x, self.position.y)
+        self.position.x = new_x
                     
     def jump(self):
         if self.is_grounded and not self.is_jumping:
@@ -222,44 +439,72 @@ class Koops:
             self.hit_points -= 1
             self.invincible = 30
             
-    def draw(self, surface):
+    def frame(self):
+        return KoopsFrame(
+            size=self.size,
+            direction=self.direction,
+            leg_offset=round(self.leg_offset),
+            head_bob=round(self.head_bob),
+            bandana_offset=round(self.bandana_offset),
+            eye_open=self.closing_eyes < 4,
+            pupil_size=4 if self.invincible % 6 >= 3 else 5,
+            hurt=self.invincible > 0 and self.invincible % 10 > 4,
+            hit_points=max(0, min(3, self.hit_points)),
+        )
+    
+    def draw(self, surface, camera_offset=0, alpha=1.0, scale=1):
+        ox, oy = KOOPS_SPRITE_ORIGIN
+        frame = self.frame()
+        sprite = Koops.frame_cache.get(frame, lambda: Koops.bake(frame))
+        x, y = lerp_point(self.previous_position, self.position, alpha)
+        return blit_sprite(surface, (Koops, frame), sprite, x - camera_offset - ox, y - oy, scale)
+        
+    @staticmethod
+    def bake(frame):
+        ox, oy = KOOPS_SPRITE_ORIGIN
+        sprite = make_layer_surface(ox + frame.size.width + 24, oy + frame.size.height + 8)
+        Koops.render(sprite, ox, oy, frame)
+        return sprite
+    
+    @staticmethod
+    def render(surface, x, y, frame):
         # Draw shadow
         pygame.draw.ellipse(surface, (*BLACK, 100), 
-            (self.position.x - 10, self.position.y + self.size.height - 5, 40, 10))
+            (x - 10, y + frame.size.height - 5, 40, 10))
         
         # Draw shell
-        shell_rect = (self.position.x - 15, self.position.y - 25, self.size.width, 25)
+        shell_rect = (x - 15, y - 25, frame.size.width, 25)
         pygame.draw.ellipse(surface, KOOPA_SHELL, shell_rect)
         pygame.draw.ellipse(surface, BLACK, shell_rect, 2)
         
         # Shell pattern
         nubs = [
-            (self.position.x, self.position.y - 10), 
-            (self.position.x - 10, self.position.y - 5),
-            (self.position.x + 10, self.position.y - 5),
-            (self.position.x, self.position.y)
+            (x, y - 10), 
+            (x - 10, y - 5),
+            (x + 10, y - 5),
+            (x, y)
         ]
         for pos in nubs:
             pygame.draw.circle(surface, (150, 175, 60), pos, 4)
             pygame.draw.circle(surface, BLACK, pos, 4, 1)
         
         # Draw head
-        head_y = self.position.y - 40 + self.head_bob
-        head_x = self.position.x
+        head_y = y - 40 + frame.head_bob
+        head_x = x
         
         # Draw bandana
         bandana_points = [
-            (head_x - 20, head_y - self.bandana_offset - 5),
-            (head_x - 15, head_y - self.bandana_offset - 8),
-            (head_x + 15, head_y - self.bandana_offset - 8),
-            (head_x + 20, head_y - self.bandana_offset - 5)
+            (head_x - 20, head_y - frame.bandana_offset - 5),
+            (head_x - 15, head_y - frame.bandana_offset - 8),
+            (head_x + 15, head_y - frame.bandana_offset - 8),
+            (head_x + 20, head_y - frame.bandana_offset - 5)
         ]
         pygame.draw.polygon(surface, BANDANA_BLUE, bandana_points)
         pygame.draw.polygon(surface, BLACK, bandana_points, 2)
         
         # Bandana knot
         pygame.draw.circle(surface, (30, 80, 200), 
-                          (head_x, head_y - self.bandana_offset - 8), 4)
+                          (head_x, head_y - frame.bandana_offset - 8), 4)
         
         # Head shape
         head_rect = (head_x - 15, head_y, 30, 18)
@@ -267,20 +512,18 @@ class Koops:
         pygame.draw.ellipse(surface, KOOPA_DARK, head_rect, 2)
         
         # Eyes
-        eye_x = head_x - 5 if self.direction == -1 else head_x + 5
-        eye_x += self.direction
+        eye_x = head_x - 5 if frame.direction == -1 else head_x + 5
+        eye_x += frame.direction
         
-        eye_open = self.closing_eyes < 4
-        eye_height = 10 if eye_open else 2
+        eye_height = 10 if frame.eye_open else 2
         pygame.draw.ellipse(surface, WHITE, 
                            (eye_x - 5, head_y + 5, 10, eye_height))
-        if eye_open:
-            pupil_size = 4 if self.invincible % 6 >= 3 else 5
+        if frame.eye_open:
             pygame.draw.circle(surface, BLACK, 
-                              (eye_x, head_y + 8), pupil_size)
+                              (eye_x, head_y + 8), frame.pupil_size)
         
         # Mouth expression
-        if self.invincible > 0 and self.invincible % 10 > 4:
+        if frame.hurt:
             pygame.draw.arc(surface, (120, 40, 40), 
                            (head_x - 12, head_y - 1, 24, 12), 
                            math.pi, 2 * math.pi, 2)
@@ -291,16 +534,16 @@ class Koops:
         
         # Legs
         for i, side in enumerate([-1, 1]):
-            leg_x = self.position.x + side * 7
-            leg_y = self.position.y - 15 + self.leg_offset * (1 if i == 0 else -1)
+            leg_x = x + side * 7
+            leg_y = y - 15 + frame.leg_offset * (1 if i == 0 else -1)
             pygame.draw.ellipse(surface, KOOPA_DARK, 
                               (leg_x - 5, leg_y, 10, 12))
             
         # Health meter
         for i in range(3):
-            fill = i < self.hit_points
-            hp_x = self.position.x + i * 15
-            hp_y = self.position.y - 55
+            fill = i < frame.hit_points
+            hp_x = x + i * 15
+            hp_y = y - 55
             
             pygame.draw.circle(surface, RED if fill else (120, 120, 120), 
                               (hp_x - 3, hp_y - 2), 4)
@@ -318,90 +561,158 @@ class Koops:
             pygame.draw.line(surface, BLACK, (hp_x + 3, hp_y - 2), (hp_x, hp_y + 5), 1)
 
 class Goomba:
+    __slots__ = ('position', 'previous_position', 'size', 'speed', 'direction', 'walk_range', 'start_x',
+                 'squish', 'crushed')
+    frame_cache = SurfaceCache(SPRITE_CACHE_BYTES)
+    # The bob only depends on the clock, so every Goomba shares it
+    animation_offset = 0
+    
     def __init__(self, x, y, walk_range=100):
-        self.position = Point(x, y)
-        self.size = Size(30, 20)
+        self.position = Vec2(x, y)
+        self.previous_position = Vec2(x, y)
+        self.size = GOOMBA_SIZE
         self.speed = 1.5
         self.direction = -1
         self.walk_range = walk_range
         self.start_x = x
         self.squish = 0
-        self.animation_offset = 0
         self.crushed = False
         
-    def update(self):
-        self.animation_offset = math.sin(pygame.time.get_ticks() * 0.03) * 2
+    def update(self, now=None):
+        if now is None:
+            now = pygame.time.get_ticks()
+        position = self.position
+        self.previous_position.set(position.x, position.y)
+        Goomba.animate(now)
         
         if not self.crushed:
-            new_x = self.position.x + self.speed * self.direction
+            new_x = position.x + self.speed * self.direction
             if abs(new_x - self.start_x) > self.walk_range:
                 self.direction *= -1
-                new_x = self.position.x + self.speed * self.direction
+                new_x = position.x + self.speed * self.direction
                 
-            self.position = Point(new_x, GROUND_LEVEL - self.size.height)
+            position.set(new_x, GROUND_LEVEL - self.size.height)
                 
-    def draw(self, surface, camera_offset):
-        if self.crushed:
+    @staticmethod
+    def animate(now):
+        Goomba.animation_offset = math.sin(now * 0.03) * 2
+        
+    def patrol_bounds(self):
+        # Everywhere this Goomba can be while walking its beat, for indexing it once instead of every step
+        reach = self.walk_range + self.speed
+        return (self.start_x - reach, GROUND_LEVEL - self.size.height,
+                2 * reach + self.size.width, self.size.height)
+        
+    def frame(self):
+        return GoombaFrame(self.size, self.crushed, round(self.animation_offset), self.squish)
+    
+    def draw(self, surface, camera_offset, alpha=1.0, scale=1):
+        ox, oy = GOOMBA_SPRITE_ORIGIN
+        frame = self.frame()
+        sprite = Goomba.frame_cache.get(frame, lambda: Goomba.bake(frame))
+        x, y = lerp_point(self.previous_position, self.position, alpha)
+        return blit_sprite(surface, (Goomba, frame), sprite, x - camera_offset - ox, y - oy, scale)
+        
+    @staticmethod
+    def bake(frame):
+        ox, oy = GOOMBA_SPRITE_ORIGIN
+        sprite = make_layer_surface(ox + frame.size.width + 12, oy + frame.size.height + 12)
+        Goomba.render(sprite, ox, oy, frame)
+        return sprite
+    
+    @staticmethod
+    def render(surface, x, y, frame):
+        if frame.crushed:
             pygame.draw.ellipse(surface, BROWN,
-                               (self.position.x - camera_offset, self.position.y + 5, 
-                                self.size.width, 8))
+                               (x, y + 5, 
+                                frame.size.width, 8))
             pygame.draw.ellipse(surface, BLACK, 
-                               (self.position.x - camera_offset, self.position.y + 5, 
-                                self.size.width, 8), 1)
+                               (x, y + 5, 
+                                frame.size.width, 8), 1)
             return
         
         pygame.draw.ellipse(surface, (*BLACK, 100), 
-                          (self.position.x - 10 - camera_offset, self.position.y + self.size.height - 3, 
+                          (x - 10, y + frame.size.height - 3, 
                            30, 8))
         
-        body_rect = (self.position.x - camera_offset, self.position.y + self.animation_offset, 
-                    self.size.width, self.size.height - (self.squish * 10))
+        body_rect = (x, y + frame.animation_offset, 
+                    frame.size.width, frame.size.height - (frame.squish * 10))
         pygame.draw.ellipse(surface, BROWN, body_rect)
         pygame.draw.ellipse(surface, BLACK, body_rect, 1)
         
         pygame.draw.ellipse(surface, BLACK, 
-                          (self.position.x - camera_offset + 5, self.position.y + self.size.height - 5, 
+                          (x + 5, y + frame.size.height - 5, 
                            6, 5))
         pygame.draw.ellipse(surface, BLACK, 
-                          (self.position.x - camera_offset + 19, self.position.y + self.size.height - 5, 
+                          (x + 19, y + frame.size.height - 5, 
                            6, 5))
         
         eye_pos = [
-            (self.position.x - camera_offset + 8, self.position.y + 7),
-            (self.position.x - camera_offset + 22, self.position.y + 7)
+            (x + 8, y + 7),
+            (x + 22, y + 7)
         ]
         for pos in eye_pos:
             pygame.draw.circle(surface, WHITE, pos, 4)
             pygame.draw.circle(surface, BLACK, pos, 2)
             
         pygame.draw.line(surface, BLACK, 
-                        (self.position.x - camera_offset + 6, self.position.y + 4),
-                        (self.position.x - camera_offset + 10, self.position.y + 2), 2)
+                        (x + 6, y + 4),
+                        (x + 10, y + 2), 2)
         pygame.draw.line(surface, BLACK, 
-                        (self.position.x - camera_offset + 24, self.position.y + 4),
-                        (self.position.x - camera_offset + 20, self.position.y + 2), 2)
+                        (x + 24, y + 4),
+                        (x + 20, y + 2), 2)
 
 class Platform:
+    __slots__ = ('position', 'size', 'color', 'is_spike', 'is_cloud')
+    sprite_cache = SurfaceCache(SPRITE_CACHE_BYTES)
+    
     def __init__(self, x, y, width, height, color=LIGHT_BROWN, is_spike=False, is_cloud=False):
         self.position = Point(x, y)
         self.size = Size(width, height)
-        self.color = color
+        self.color = Color(*color)
         self.is_spike = is_spike
         self.is_cloud = is_cloud
         
-    def draw(self, surface, camera_offset):
-        x_pos = self.position.x - camera_offset
+    @property
+    def kind(self):
+        if self.is_cloud:
+            return 'cloud'
+        if self.is_spike:
+            return 'spike'
+        return 'normal'
+    
+    def sprite_key(self):
+        return (self.size, self.color, self.kind)
+    
+    def sprite(self):
+        return Platform.sprite_cache.get(self.sprite_key(), self.bake)
+    
+    def bake(self):
+        # Bricks, spikes and cloud fluffs spill past the collision box, so bake with a margin
+        margin = PLATFORM_SPRITE_MARGIN
+        width = self.size.width
+        if self.is_cloud:
+            width = max(width, CLOUD_FLUFF_EXTENT)
+        sprite = make_layer_surface(width + 2 * margin, self.size.height + 2 * margin)
+        self.render(sprite, margin, margin)
+        return sprite
+    
+    def draw(self, surface, camera_offset, scale=1):
+        return blit_sprite(surface, (Platform, self.sprite_key()), self.sprite(),
+                           self.position.x - camera_offset - PLATFORM_SPRITE_MARGIN,
+                           self.position.y - PLATFORM_SPRITE_MARGIN, scale)
         
+    def render(self, surface, x_pos, y_pos):
         if self.is_cloud:
-            base_rect = (x_pos, self.position.y, self.size.width, 15)
+            base_rect = (x_pos, y_pos, self.size.width, 15)
             pygame.draw.rect(surface, (250, 250, 250), base_rect)
             pygame.draw.rect(surface, (200, 200, 200), base_rect, 2)
             
             fluffs = [
-                (x_pos + 10, self.position.y - 8, 25, 18),
-                (x_pos + 40, self.position.y - 5, 35, 22),
-                (x_pos + 90, self.position.y - 6, 30, 20),
-                (x_pos + 140, self.position.y - 8, 25, 18)
+                (x_pos + 10, y_pos - 8, 25, 18),
+                (x_pos + 40, y_pos - 5, 35, 22),
+                (x_pos + 90, y_pos - 6, 30, 20),
+                (x_pos + 140, y_pos - 8, 25, 18)
             ]
             for fluff in fluffs:
                 pygame.draw.ellipse(surface, (250, 250, 250), fluff)
@@ -409,219 +720,983 @@ class Platform:
             return
         elif self.is_spike:
             pygame.draw.rect(surface, (140, 140, 140), 
-                           (x_pos, self.position.y, self.size.width, self.size.height))
+                           (x_pos, y_pos, self.size.width, self.size.height))
             pygame.draw.rect(surface, BLACK, 
-                           (x_pos, self.position.y, self.size.width, self.size.height), 2)
+                           (x_pos, y_pos, self.size.width, self.size.height), 2)
             
             for i in range(0, self.size.width, 15):
                 spike_points = [
-                    (x_pos + i, self.position.y + self.size.height),
-                    (x_pos + i + 7, self.position.y + self.size.height - 12),
-                    (x_pos + i + 14, self.position.y + self.size.height)
+                    (x_pos + i, y_pos + self.size.height),
+                    (x_pos + i + 7, y_pos + self.size.height - 12),
+                    (x_pos + i + 14, y_pos + self.size.height)
                 ]
                 pygame.draw.polygon(surface, (100, 100, 100), spike_points)
                 pygame.draw.polygon(surface, BLACK, spike_points, 1)
             return
             
         pygame.draw.rect(surface, self.color, 
-                        (x_pos, self.position.y, self.size.width, self.size.height))
+                        (x_pos, y_pos, self.size.width, self.size.height))
         pygame.draw.rect(surface, (80, 45, 30), 
-                        (x_pos, self.position.y, self.size.width, self.size.height), 2)
+                        (x_pos, y_pos, self.size.width, self.size.height), 2)
         
         for i in range(0, self.size.width, 20):
             for j in range(0, self.size.height, 15):
                 brick_x = x_pos + i
-                brick_y = self.position.y + j
+                brick_y = y_pos + j
                 pygame.draw.rect(surface, (self.color.r-20, self.color.g-20, self.color.b-20),
                                (brick_x, brick_y, 18, 13))
                 
         pygame.draw.line(surface, (self.color.r+20, self.color.g+20, self.color.b+20),
-                        (x_pos + self.size.width - 1, self.position.y),
-                        (x_pos + self.size.width - 1, self.position.y + self.size.height), 2)
+                        (x_pos + self.size.width - 1, y_pos),
+                        (x_pos + self.size.width - 1, y_pos + self.size.height), 2)
         pygame.draw.line(surface, (self.color.r+20, self.color.g+20, self.color.b+20),
-                        (x_pos, self.position.y),
-                        (x_pos + self.size.width, self.position.y), 2)
+                        (x_pos, y_pos),
+                        (x_pos + self.size.width, y_pos), 2)
 
 class Coin:
+    __slots__ = ('position', 'collected')
+    frame_cache = SurfaceCache(SPRITE_CACHE_BYTES)
+    # The bob, spin and flash only depend on the clock, so every coin shares them
+    animation_offset = 0
+    rotation = 0
+    flash = 0
+    
     def __init__(self, x, y):
         self.position = Point(x, y)
         self.collected = False
-        self.animation_offset = 0
-        self.rotation = 0
-        self.flash = 0
         
-    def update(self):
+    def update(self, now=None):
         if self.collected:
             return
-        self.animation_offset = math.sin(pygame.time.get_ticks() * 0.03) * 3
-        self.rotation = (pygame.time.get_ticks() % 360) * 2
-        self.flash = math.sin(pygame.time.get_ticks() * 0.1)
+        if now is None:
+            now = pygame.time.get_ticks()
+        Coin.animate(now)
+        
+    @staticmethod
+    def animate(now):
+        Coin.animation_offset = math.sin(now * 0.03) * 3
+        Coin.rotation = (now % 360) * 2
+        Coin.flash = math.sin(now * 0.1)
         
-    def draw(self, surface, camera_offset):
+    def frame(self):
+        return CoinFrame(self.rotation % 360, self.flash > 0.5)
+    
+    def sprite(self):
+        frame = self.frame()
+        return Coin.frame_cache.get(frame, lambda: Coin.bake(frame))
+    
+    def draw(self, surface, camera_offset, scale=1):
         if self.collected:
             return
-            
-        coin_y = self.position.y + self.animation_offset
-        coin_x = self.position.x - camera_offset
-        coin_size = 15
+        return Coin.render(surface, (self.position.x - camera_offset) * scale,
+                           (self.position.y + self.animation_offset) * scale, self.frame(), scale)
+    
+    @staticmethod
+    def bake(frame):
+        ox, oy = COIN_SPRITE_ORIGIN
+        sprite = make_layer_surface(2 * ox + 1, 2 * oy + 1)
+        Coin.render(sprite, ox, oy, frame)
+        return sprite
+    
+    @staticmethod
+    def render(surface, coin_x, coin_y, frame, scale=1):
+        coin_size = 15 * scale
+        rotation = math.radians(frame.rotation)
         
-        pygame.draw.circle(surface, YELLOW, (coin_x, coin_y), coin_size)
+        bounds = pygame.draw.circle(surface, YELLOW, (coin_x, coin_y), coin_size)
         
-        if self.flash > 0.5:
+        if frame.flash:
             pygame.draw.ellipse(surface, (255, 255, 200),
                               (coin_x - coin_size*0.7, coin_y - coin_size*0.5, 
                                coin_size*1.4, coin_size*1.0))
         
         pygame.draw.line(surface, ORANGE,
-                       (coin_x - math.sin(math.radians(self.rotation)) * coin_size * 0.7,
-                        coin_y - math.cos(math.radians(self.rotation)) * coin_size * 0.7),
-                       (coin_x + math.sin(math.radians(self.rotation)) * coin_size * 0.7,
-                        coin_y + math.cos(math.radians(self.rotation)) * coin_size * 0.7), 
-                       3)
+                       (coin_x - math.sin(rotation) * coin_size * 0.7,
+                        coin_y - math.cos(rotation) * coin_size * 0.7),
+                       (coin_x + math.sin(rotation) * coin_size * 0.7,
+                        coin_y + math.cos(rotation) * coin_size * 0.7), 
+                       max(1, round(3 * scale)))
         
-        pygame.draw.circle(surface, (200, 170, 0), (coin_x, coin_y), coin_size, 2)
+        pygame.draw.circle(surface, (200, 170, 0), (coin_x, coin_y), coin_size, max(1, round(2 * scale)))
+        return bounds
 
 class DialogBox:
-    def __init__(self, text, x, y, width, height):
+    def __init__(self, text, x, y, width, height, text_size=DIALOG_TEXT_SIZE):
         self.text = text
         self.position = Point(x, y)
         self.size = Size(width, height)
+        self.text_size = text_size
+        self.pages = self.paginate(text)
+        self.page = 0
         self.timer = 0
+        self.hold = 0
         self.typing_index = 0
         self.open = False
+        self.surface = None
+        self.drawn_index = 0
+        self.scaled_page = None
+        self.scaled_key = None
         
+    def text_width(self, length):
+        return (length - 1) * self.text_size * 0.7 + self.text_size if length else 0
+    
+    def paginate(self, text):
+        # Word-wrap into the box, then split the lines into pages; each page is a list of
+        # (char, column, line) placements in typing order
+        max_width = self.size.width - 2 * DIALOG_PADDING
+        lines = []
+        for paragraph in text.split("\n"):
+            line = ""
+            for word in paragraph.split():
+                candidate = f"{line} {word}" if line else word
+                if line and self.text_width(len(candidate)) > max_width:
+                    lines.append(line)
+                    candidate = word
+                line = candidate
+            lines.append(line)
+            
+        per_page = max(1, (self.size.height - DIALOG_PADDING) // DIALOG_LINE_HEIGHT)
+        pages = []
+        for first in range(0, len(lines), per_page):
+            page_lines = lines[first:first + per_page]
+            pages.append([(char, column, row) for row, line in enumerate(page_lines)
+                          for column, char in enumerate(line)])
+        return pages
+    
+    @property
+    def page_done(self):
+        return self.typing_index >= len(self.pages[self.page])
+    
     def update(self):
         self.timer += 1
-        if self.typing_index < len(self.text) and self.timer % 3 == 0:
-            self.typing_index += 1
+        if not self.page_done:
+            if self.timer % 3 == 0:
+                self.typing_index += 1
+        elif self.page < len(self.pages) - 1:
+            self.hold += 1
+            if self.hold >= DIALOG_PAGE_HOLD:
+                self.turn_page(self.page + 1)
+                
+    def advance(self):
+        # Finish typing the current page, or move on to the next one if it is already complete
+        if not self.page_done:
+            self.typing_index = len(self.pages[self.page])
+        elif self.page < len(self.pages) - 1:
+            self.turn_page(self.page + 1)
             
+    def turn_page(self, page):
+        self.page = page
+        self.hold = 0
+        self.typing_index = 0
+        self.surface = None
+        self.scaled_page = None
+        
     def open_box(self):
         self.open = True
         self.timer = 0
-        self.typing_index = 0
-            
-    def draw(self, surface):
+        self.turn_page(0)
+        
+    def build_page(self):
+        surface = pygame.Surface(self.size)
+        surface.fill(PAPER_YELLOW)
+        pygame.draw.rect(surface, BLACK, (0, 0, *self.size), 3)
+        self.drawn_index = 0
+        return surface
+    
+    @property
+    def arrow_visible(self):
+        return self.page_done and self.timer % 20 < 10
+    
+    def arrow(self):
+        arrow_y = self.position.y + self.size.height - 18
+        return [
+            (self.position.x + self.size.width - 25, arrow_y),
+            (self.position.x + self.size.width - 15, arrow_y),
+            (self.position.x + self.size.width - 20, arrow_y + 7)
+        ]
+    
+    @staticmethod
+    def bake_arrow():
+        sprite = make_layer_surface(11, 8)
+        pygame.draw.polygon(sprite, BLACK, [(0, 0), (10, 0), (5, 7)])
+        return sprite
+    
+    def type_page(self):
+        # The page surface keeps what has been typed so far; only newly revealed glyphs are drawn
+        # into it. Returns whether the page changed
+        if self.surface is None:
+            self.surface = self.build_page()
+        pad = VectorFont.padding(2)
+        advance = self.text_size * 0.7
+        placements = self.pages[self.page]
+        typed = placements[self.drawn_index:self.typing_index]
+        for char, column, row in typed:
+            if char != " ":
+                glyph = VectorFont.glyph_surface(char, self.text_size, BLACK)
+                self.surface.blit(glyph, (DIALOG_PADDING - pad + round(column * advance),
+                                          DIALOG_PADDING - pad + row * DIALOG_LINE_HEIGHT))
+        self.drawn_index = max(self.drawn_index, min(self.typing_index, len(placements)))
+        return bool(typed)
+    
+    def draw(self, surface, scale=1):
         if not self.open:
             return
-            
-        pygame.draw.rect(surface, PAPER_YELLOW, 
-                       (self.position.x, self.position.y, self.size.width, self.size.height))
-        pygame.draw.rect(surface, BLACK, 
-                       (self.position.x, self.position.y, self.size.width, self.size.height), 3)
-        
-        displayed_text = self.text[:self.typing_index]
-        VectorFont.render_text(surface, displayed_text, 
-                            self.position.x + 20, self.position.y + 20, 
-                            22, BLACK)
-        
-        if self.typing_index == len(self.text) and self.timer % 20 < 10:
-            arrow_y = self.position.y + self.size.height - 18
-            pygame.draw.polygon(surface, BLACK, [
-                (self.position.x + self.size.width - 25, arrow_y),
-                (self.position.x + self.size.width - 15, arrow_y),
-                (self.position.x + self.size.width - 20, arrow_y + 7)
-            ])
+        
+        self.type_page()
+        if scale == 1:
+            bounds = surface.blit(self.surface, self.position)
+        else:
+            # The shrunk page is only rebuilt when more text has been typed into it
+            if self.scaled_page is None or self.scaled_key != (self.drawn_index, scale):
+                self.scaled_page = scale_layer(self.surface, scaled_size(self.size, scale))
+                self.scaled_key = (self.drawn_index, scale)
+            bounds = surface.blit(self.scaled_page, (self.position.x * scale, self.position.y * scale))
+        
+        if self.arrow_visible:
+            pygame.draw.polygon(surface, BLACK, [(x * scale, y * scale) for x, y in self.arrow()])
+        return bounds
+    
+    def draw_textures(self, textures):
+        if not self.open:
+            return
+        if self.type_page():
+            textures.refresh(self.surface)
+        textures.blit(self.surface, self.position)
+        if self.arrow_visible:
+            textures.blit(SCREEN_LAYERS.get('dialog_arrow', DialogBox.bake_arrow), self.arrow()[0])
 
 class Camera:
     def __init__(self):
         self.offset = 0
+        self.previous_offset = 0
         self.target_offset = 0
         
     def update(self, target_x):
+        self.previous_offset = self.offset
         self.target_offset = target_x - WIDTH//2
         self.offset += (self.target_offset - self.offset) * CAMERA_SMOOTHNESS
         
     def apply(self, position):
         return position - self.offset
+    
+    def interpolated(self, alpha):
+        return lerp(self.previous_offset, self.offset, alpha)
+
+class DirtyRectRenderer:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.dirty = []
+        self.previous = []
+        self.full_redraw = True
+        self.scene = None
+        self.full_frames = 0
+        self.partial_frames = 0
+        
+    def mark(self, *rects):
+        for rect in rects:
+            if rect:
+                self.dirty.append(pygame.Rect(rect))
+                
+    def invalidate(self):
+        self.full_redraw = True
+        
+    def present(self, scene):
+        if scene != self.scene:
+            self.scene = scene
+            self.full_redraw = True
+            
+        if not self.enabled or self.full_redraw:
+            pygame.display.flip()
+            self.full_frames += 1
+        else:
+            # Areas drawn last frame are sent again so moved objects leave no trails
+            pygame.display.update(self.previous + self.dirty)
+            self.partial_frames += 1
+            
+        self.previous = self.dirty
+        self.dirty = []
+        self.full_redraw = False
+
+class RenderTarget:
+    # Gameplay is drawn into a surface at a fraction of the window resolution and upscaled
+    # onto the window once per frame; at scale 1 the window itself is the target
+    def __init__(self, screen, scale=1.0, smooth=False, auto=False, fps=FPS):
+        self.screen = screen
+        self.smooth = smooth and screen.get_bytesize() >= 3
+        self.auto = auto
+        self.budget = 1.0 / (fps or FPS)
+        self.levels = [scale] + [level for level in RENDER_SCALES if level < scale]
+        self.level = 0
+        self.frame_total = 0.0
+        self.frames = 0
+        self.changes = 0
+        self.set_scale(scale)
+        
+    @property
+    def scaled(self):
+        return self.surface is not self.screen
+    
+    def set_scale(self, scale):
+        self.scale = scale
+        if scale == 1:
+            self.surface = self.screen
+        else:
+            self.surface = pygame.Surface(scaled_size(self.screen.get_size(), scale), 0, self.screen)
+            
+    def present(self):
+        if not self.scaled:
+            return
+        if self.smooth:
+            pygame.transform.smoothscale(self.surface, self.screen.get_size(), self.screen)
+        else:
+            pygame.transform.scale(self.surface, self.screen.get_size(), self.screen)
+            
+    def adapt(self, frame_time):
+        # Once per window of frames: step down a level when the mean frame time is over budget,
+        # and back up when the frame would still fit if its cost grew with the pixel count
+        if not self.auto:
+            return
+        self.frame_total += frame_time
+        self.frames += 1
+        if self.frames < RENDER_SCALE_WINDOW:
+            return
+        mean = self.frame_total / self.frames
+        self.frame_total = 0.0
+        self.frames = 0
+        
+        level = self.level
+        if mean > self.budget and level < len(self.levels) - 1:
+            level += 1
+        elif level > 0 and mean * (self.levels[level - 1] / self.scale) ** 2 < self.budget * RENDER_SCALE_HEADROOM:
+            level -= 1
+        if level != self.level:
+            self.level = level
+            self.changes += 1
+            self.set_scale(self.levels[level])
+
+class TextureCache(SurfaceCache):
+    @staticmethod
+    def surface_bytes(texture):
+        return texture.width * texture.height * 4
+
+class StreamingLayer:
+    # A transparent software layer for what is still rasterized every frame; its texture is only
+    # uploaded again when something was drawn into the layer or erased from it
+    def __init__(self, renderer, size):
+        self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        self.texture = sdl_video.Texture(renderer, size, streaming=True)
+        self.texture.blend_mode = pygame.BLENDMODE_BLEND
+        self.bounds = None
+        
+    def draw(self, draw):
+        if self.bounds is not None:
+            self.surface.fill((0, 0, 0, 0), self.bounds)
+        bounds = draw(self.surface)
+        if bounds is not None or self.bounds is not None:
+            self.texture.update(self.surface)
+        self.bounds = bounds
+        if bounds is not None:
+            self.texture.draw()
+        return bounds
+
+class TextureRenderer:
+    # Presents frames through an SDL renderer. Baked surfaces (sprites, layers, the HUD and dialog
+    # pages) are uploaded once and drawn as texture copies, which SDL batches into few draw calls.
+    # blit() mirrors Surface.blit so sprite and layer drawing code can target either.
+    def __init__(self, window, renderer, size=(WIDTH, HEIGHT)):
+        self.window = window
+        self.renderer = renderer
+        self.size = size
+        # The frame is laid out at the game's resolution and scaled to the window on the GPU
+        renderer.logical_size = size
+        self.textures = TextureCache(TEXTURE_CACHE_BYTES)
+        self.frame = pygame.Surface(size, 0, 32)
+        self.frame_texture = sdl_video.Texture(renderer, size, streaming=True)
+        self.particles = StreamingLayer(renderer, size)
+        self.overlay = StreamingLayer(renderer, size)
+        
+    @classmethod
+    def create(cls, title, size=(WIDTH, HEIGHT), accelerated=True):
+        # Returns None when there is no renderer of the requested kind
+        if sdl_video is None:
+            return None
+        os.environ.setdefault('SDL_RENDER_BATCHING', '1')
+        window = sdl_video.Window(title, size, resizable=True)
+        try:
+            renderer = sdl_video.Renderer(window, accelerated=1 if accelerated else 0)
+        except sdl_video.error:
+            window.destroy()
+            return None
+        return cls(window, renderer, size)
+    
+    def get_size(self):
+        return self.size
+    
+    def get_width(self):
+        return self.size[0]
+    
+    def texture(self, surface):
+        return self.textures.get(surface, lambda: sdl_video.Texture.from_surface(self.renderer, surface))
+    
+    def refresh(self, surface):
+        # Uploads a surface that was drawn into since its texture was made
+        texture = self.textures.entries.get(surface)
+        if texture is not None:
+            texture.update(surface)
+            
+    def blit(self, surface, position):
+        texture = self.texture(surface)
+        texture.draw(dstrect=position)
+        return pygame.Rect(position, (texture.width, texture.height))
+    
+    def begin(self):
+        self.renderer.draw_color = (0, 0, 0, 255)
+        self.renderer.clear()
+        
+    def present(self):
+        self.renderer.present()
+        
+    def present_surface(self, surface):
+        # Scenes still drawn in software go up as one streamed frame
+        self.frame_texture.update(surface)
+        self.begin()
+        self.frame_texture.draw()
+        self.present()
+
+class FrameProfiler:
+    STAGES = ('input', 'koops', 'particles', 'collisions', 'background', 'ground',
+              'entities', 'ui', 'upscale', 'overlay', 'present')
+    
+    def __init__(self, enabled=False, history=PROFILE_HISTORY):
+        self.enabled = enabled
+        self.visible = enabled
+        self.stage_index = {stage: i for i, stage in enumerate(self.STAGES)}
+        self.samples = np.zeros((len(self.STAGES), history), dtype=np.float32)
+        self.totals = [0.0] * len(self.STAGES)
+        self.cursor = 0
+        self.filled = 0
+        self.last = 0.0
+        
+    def toggle(self):
+        self.visible = not self.visible
+        self.enabled = self.visible
+        if self.enabled:
+            # begin_frame has already run for this frame, so start its laps from here
+            self.totals = [0.0] * len(self.STAGES)
+            self.last = time.perf_counter()
+        
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.totals = [0.0] * len(self.STAGES)
+        self.last = time.perf_counter()
+        
+    def lap(self, stage):
+        # Charges the time since the previous lap to this stage; repeated
+        # laps within a frame (several simulation steps) accumulate
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.totals[self.stage_index[stage]] += now - self.last
+        self.last = now
+        
+    def end_frame(self, commit=True):
+        if not self.enabled or not commit:
+            return
+        self.samples[:, self.cursor] = self.totals
+        self.cursor = (self.cursor + 1) % self.samples.shape[1]
+        self.filled = min(self.filled + 1, self.samples.shape[1])
+        
+    def percentiles(self):
+        if self.filled == 0:
+            return {}
+        window = self.samples[:, :self.filled] * 1000
+        p50, p95, p99 = np.percentile(window, [50, 95, 99], axis=1)
+        return {stage: {'p50': float(p50[i]), 'p95': float(p95[i]), 'p99': float(p99[i])}
+                for i, stage in enumerate(self.STAGES)}
+    
+    def report(self, culling=None):
+        lines = [f"{'stage':<12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"]
+        for stage, values in self.percentiles().items():
+            lines.append(f"{stage:<12}{values['p50']:>9.3f}{values['p95']:>9.3f}{values['p99']:>9.3f}")
+        for kind, (visible, culled) in (culling or {}).items():
+            lines.append(f"{kind:<12}{visible:>9} drawn{culled:>9} culled")
+        return "\n".join(lines)
+    
+    def draw(self, surface, culling=None):
+        if not self.visible or self.filled == 0:
+            return None
+        
+        culling = culling or {}
+        means = self.samples[:, :self.filled].mean(axis=1) * 1000
+        budget_ms = 1000 / FPS
+        bar_scale = 150 / budget_ms
+        row = 16
+        panel = pygame.Rect(10, 80, 280, row * (len(self.STAGES) + len(culling)) + 16)
+        
+        pygame.draw.rect(surface, (20, 20, 40), panel)
+        pygame.draw.rect(surface, WHITE, panel, 1)
+        budget_x = panel.x + 110 + budget_ms * bar_scale
+        pygame.draw.line(surface, RED, (budget_x, panel.y + 4), (budget_x, panel.bottom - 4), 1)
+        
+        for i, stage in enumerate(self.STAGES):
+            y = panel.y + 8 + i * row
+            VectorFont.render_text(surface, stage.upper(), panel.x + 8, y, 10, WHITE, BLACK, 1)
+            width = min(int(means[i] * bar_scale), panel.right - panel.x - 118)
+            pygame.draw.rect(surface, YELLOW if means[i] < budget_ms / 4 else ORANGE,
+                             (panel.x + 110, y, max(1, width), row - 6))
+            
+        # Drawn / culled counts for the last frame
+        for i, (kind, (visible, culled)) in enumerate(culling.items()):
+            y = panel.y + 8 + (len(self.STAGES) + i) * row
+            VectorFont.render_text(surface, kind.upper(), panel.x + 8, y, 10, WHITE, BLACK, 1)
+            VectorFont.render_text(surface, f"{visible} / {culled}", panel.x + 110, y, 10, YELLOW, BLACK, 1)
+        return panel
+
+class SpatialHash:
+    def __init__(self, cell_size=128):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = {}
+        self.counter = 0
+        
+    def _cell_range(self, x, y, width, height):
+        cs = self.cell_size
+        x0, x1 = int(x // cs), int((x + width) // cs)
+        y0, y1 = int(y // cs), int((y + height) // cs)
+        return [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+        
+    def insert(self, obj, x, y, width, height):
+        if obj in self.entries:
+            self.remove(obj)
+        cells = self._cell_range(x, y, width, height)
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(obj)
+        self.entries[obj] = (self.counter, cells)
+        self.counter += 1
+        
+    def remove(self, obj):
+        entry = self.entries.pop(obj, None)
+        if entry is None:
+            return
+        for cell in entry[1]:
+            bucket = self.cells[cell]
+            bucket.remove(obj)
+            if not bucket:
+                del self.cells[cell]
+                
+    def query(self, x, y, width, height):
+        found = {}
+        for cell in self._cell_range(x, y, width, height):
+            for obj in self.cells.get(cell, ()):
+                found[obj] = self.entries[obj][0]
+        # Keep the original list order so overlapping platforms resolve the same way
+        return sorted(found, key=found.get)
+    
+    def __len__(self):
+        return len(self.entries)
+
+def index_platforms(platforms, cell_size=128):
+    index = SpatialHash(cell_size)
+    for platform in platforms:
+        index.insert(platform, platform.position.x, platform.position.y,
+                     platform.size.width, platform.size.height)
+    return index
 
 class ParticleSystem:
-    def __init__(self):
-        self.particles = []
+    def __init__(self, capacity=PARTICLE_CAPACITY, seed=None):
+        self.capacity = capacity
+        self.positions = np.zeros((capacity, 2), dtype=np.float32)
+        self.velocities = np.zeros((capacity, 2), dtype=np.float32)
+        self.lifetimes = np.zeros(capacity, dtype=np.int32)
+        self.colors = np.zeros(capacity, dtype=np.uint32)
+        self.count = 0
+        self.rng = np.random.default_rng(seed)
+        self.drawn = 0
+        self.disc_offsets = {}
         
+    def __len__(self):
+        return self.count
+    
+    def _arrays(self):
+        # 64-bit views let each (x, y) pair move as a single element during compaction
+        return (self.positions.view(np.uint64).reshape(-1),
+                self.velocities.view(np.uint64).reshape(-1),
+                self.lifetimes, self.colors)
+    
     def add_particles(self, position, count, color, velocity_range_x=(-2.5, 2.5), velocity_range_y=(-3.5, -1.5), lifetime=30):
-        for _ in range(count):
-            self.particles.append([
-                position.x, position.y,
-                random.uniform(*velocity_range_x), 
-                random.uniform(*velocity_range_y),
-                lifetime,
-                color
-            ])
+        count = min(count, self.capacity)
+        if count <= 0:
+            return
+        
+        # Ring buffer: when full, the oldest particles make room for the new burst
+        overflow = self.count + count - self.capacity
+        if overflow > 0:
+            keep = self.count - overflow
+            for array in self._arrays():
+                array[:keep] = array[overflow:self.count]
+            self.count = keep
+            
+        start, end = self.count, self.count + count
+        self.positions[start:end] = (position[0], position[1])
+        self.velocities[start:end, 0] = self.rng.uniform(*velocity_range_x, count)
+        self.velocities[start:end, 1] = self.rng.uniform(*velocity_range_y, count)
+        self.lifetimes[start:end] = lifetime
+        r, g, b = tuple(color)[:3]
+        self.colors[start:end] = (r << 16) | (g << 8) | b
+        self.count = end
             
     def update(self):
-        for p in self.particles[:]:
-            p[0] += p[2]
-            p[1] += p[3]
-            p[3] += 0.15
-            p[4] -= 1
-                
-            if p[4] <= 0:
-                self.particles.remove(p)
+        n = self.count
+        if n == 0:
+            return
+        
+        self.positions[:n] += self.velocities[:n]
+        self.velocities[:n, 1] += PARTICLE_GRAVITY
+        self.lifetimes[:n] -= 1
+        
+        alive = self.lifetimes[:n] > 0
+        survivors = int(np.count_nonzero(alive))
+        if survivors < n:
+            for array in self._arrays():
+                array[:survivors] = array[:n][alive]
+            self.count = survivors
+            
+    def _disc(self, radius):
+        # The pixels pygame.draw.circle fills around an integer centre, so splatted particles
+        # keep exactly the shape of drawn ones
+        offsets = self.disc_offsets.get(radius)
+        if offsets is None:
+            centre = radius + 1
+            stamp = pygame.Surface((2 * centre, 2 * centre), 0, 32)
+            pygame.draw.circle(stamp, WHITE, (centre, centre), radius)
+            dx, dy = np.nonzero(pygame.surfarray.array2d(stamp))
+            offsets = (dx.astype(np.int32) - centre, dy.astype(np.int32) - centre)
+            self.disc_offsets[radius] = offsets
+        return offsets
     
-    def draw(self, surface, camera_offset):
-        for p in self.particles:
-            pygame.draw.circle(surface, p[5], 
-                           (int(p[0] - camera_offset), int(p[1])), 
-                           max(1, int(p[4] / 10)))
+    def draw(self, surface, camera_offset, scale=1):
+        n = self.count
+        self.drawn = 0
+        if n == 0:
+            return
+        
+        xs = self.positions[:n, 0] - camera_offset
+        ys = self.positions[:n, 1]
+        radii = self.lifetimes[:n] // 10
+        if scale != 1:
+            xs, ys, radii = xs * scale, ys * scale, (radii * scale).astype(np.int32)
+        xs, ys = xs.astype(np.int32), ys.astype(np.int32)
+        radii = np.maximum(1, radii)
+        colors = self.colors[:n]
+        
+        width, height = surface.get_size()
+        visible = (xs > -radii) & (xs < width + radii) & (ys > -radii) & (ys < height + radii)
+        xs, ys, radii, colors = xs[visible], ys[visible], radii[visible], colors[visible]
+        self.drawn = len(xs)
+        if len(xs) == 0:
+            return None
+        reach = int(radii.max())
+        left, top = int(xs.min()) - reach, int(ys.min()) - reach
+        bounds = pygame.Rect(left, top, int(xs.max()) + reach - left + 1, int(ys.max()) + reach - top + 1)
+        
+        pixels = None
+        if surface.get_bytesize() > 1:
+            try:
+                pixels = pygame.surfarray.pixels2d(surface)
+            except (ValueError, pygame.error):
+                pass
+            
+        # Small particles are splatted straight into the pixel array; big ones use draw.circle
+        if pixels is None:
+            large = np.ones(len(radii), dtype=bool)
+        else:
+            large = radii > PARTICLE_SPLAT_RADIUS
+            mapped = self._map_colors(surface, colors)
+            # A flat view over the pixel rows, pitch included, turns each disc pixel into a fixed
+            # offset from the particle's own index
+            row = pixels.strides[1] // pixels.itemsize
+            flat = np.lib.stride_tricks.as_strided(pixels, shape=(row * (height - 1) + width,),
+                                                   strides=(pixels.itemsize,))
+            for radius in range(1, PARTICLE_SPLAT_RADIUS + 1):
+                selected = radii == radius
+                if not selected.any():
+                    continue
+                px, py, pc = xs[selected], ys[selected], mapped[selected]
+                dx, dy = self._disc(radius)
+                interior = ((px >= radius) & (px < width - radius) &
+                            (py >= radius) & (py < height - radius))
+                base = (py[interior] * row + px[interior]).astype(np.intp)
+                ic = pc[interior]
+                edge = ~interior
+                ex, ey, ec = px[edge], py[edge], pc[edge]
+                for offset_x, offset_y, offset in zip(dx.tolist(), dy.tolist(), (dy * row + dx).tolist()):
+                    flat[base + offset] = ic
+                    if len(ex):
+                        x, y = ex + offset_x, ey + offset_y
+                        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+                        flat[y[inside] * row + x[inside]] = ec[inside]
+            del flat, pixels
+            
+        for x, y, r, c in zip(xs[large].tolist(), ys[large].tolist(), radii[large].tolist(), colors[large].tolist()):
+            pygame.draw.circle(surface, ((c >> 16) & 255, (c >> 8) & 255, c & 255), (x, y), r)
+        return bounds
+            
+    @staticmethod
+    def _map_colors(surface, colors):
+        r_shift, g_shift, b_shift, _ = surface.get_shifts()
+        r_loss, g_loss, b_loss, _ = surface.get_losses()
+        r = (colors >> 16) & 255
+        g = (colors >> 8) & 255
+        b = colors & 255
+        return (((r >> r_loss) << r_shift) | ((g >> g_loss) << g_shift) |
+                ((b >> b_loss) << b_shift) | np.uint32(surface.get_masks()[3]))
 
-def draw_background(surface, camera_offset):
-    for i in range(HEIGHT//2):
-        color_val = 140 + int(i/HEIGHT*80)
-        pygame.draw.line(surface, (color_val, color_val, 255), 
-                       (0, i), (WIDTH, i))
+class GoombaBatch:
+    # Patrol state for the live Goombas of a list in flat arrays, advanced for all of them at once.
+    # Positions are only copied onto the Goomba objects something is about to read; crushed Goombas
+    # leave the arrays for a list that is drawn but never stepped.
+    def __init__(self, goombas):
+        self.goombas = [goomba for goomba in goombas if not goomba.crushed]
+        self.crushed = [goomba for goomba in goombas if goomba.crushed]
+        self.x = np.array([goomba.position.x for goomba in self.goombas], dtype=np.float64)
+        self.previous_x = self.x.copy()
+        self.start_x = np.array([goomba.start_x for goomba in self.goombas], dtype=np.float64)
+        self.walk_range = np.array([goomba.walk_range for goomba in self.goombas], dtype=np.float64)
+        self.speed = np.array([goomba.speed for goomba in self.goombas], dtype=np.float64)
+        self.direction = np.array([goomba.direction for goomba in self.goombas], dtype=np.float64)
+        self.slots = {goomba: index for index, goomba in enumerate(self.goombas)}
+        
+    def __len__(self):
+        return len(self.goombas) + len(self.crushed)
+    
+    def crush(self, goomba):
+        index = self.slots[goomba]
+        self.sync([index])
+        goomba.crushed = True
+        goomba.previous_position.set(goomba.position.x, goomba.position.y)
+        # Move the last live Goomba into the freed slot and shrink the arrays by one
+        last = len(self.goombas) - 1
+        moved = self.goombas[last]
+        for name in ('x', 'previous_x', 'start_x', 'walk_range', 'speed', 'direction'):
+            array = getattr(self, name)
+            array[index] = array[last]
+            setattr(self, name, array[:last])
+        self.goombas[index] = moved
+        self.slots[moved] = index
+        self.goombas.pop()
+        del self.slots[goomba]
+        self.crushed.append(goomba)
+        
+    def update(self, now):
+        Goomba.animate(now)
+        if not self.goombas:
+            return
+        
+        x, direction, speed = self.x, self.direction, self.speed
+        np.copyto(self.previous_x, x)
+        new_x = x + speed * direction
+        flip = np.abs(new_x - self.start_x) > self.walk_range
+        if flip.any():
+            direction[flip] *= -1
+            new_x[flip] = x[flip] + speed[flip] * direction[flip]
+        np.copyto(x, new_x)
+        
+    def sync(self, indices):
+        # Copy the array state onto the Goombas at `indices`, for drawing or collision tests
+        if not indices:
+            return
+        ground_y = GROUND_LEVEL - GOOMBA_SIZE.height
+        goombas = self.goombas
+        for index, x, previous_x, direction in zip(indices, self.x[indices].tolist(),
+                                                   self.previous_x[indices].tolist(),
+                                                   self.direction[indices].tolist()):
+            goomba = goombas[index]
+            goomba.position.set(x, ground_y)
+            goomba.previous_position.set(previous_x, ground_y)
+            goomba.direction = int(direction)
+            
+    def sync_goombas(self, goombas):
+        self.sync([self.slots[goomba] for goomba in goombas])
+        
+    def sync_all(self):
+        self.sync(list(range(len(self.goombas))))
+        
+class CoinBatch:
+    def __init__(self, coins):
+        self.coins = coins
+        self.live = [coin for coin in coins if not coin.collected]
+        
+    def __len__(self):
+        return len(self.coins)
+    
+    def collect(self, coin):
+        coin.collected = True
+        self.live.remove(coin)
+        
+    def update(self, now):
+        # Every coin reads the shared animation state, so there is nothing to do per coin
+        Coin.animate(now)
+
+class BackgroundLayer:
+    def __init__(self, build, parallax, y=0):
+        self.build = build
+        self.parallax = parallax
+        self.y = y
+        self.surface = None
+        self.size = None
+        self.scaled = {}
+        
+    def install(self, surface, size):
+        self.surface = surface
+        self.size = size
+        self.scaled = {}
+        
+    def draw(self, surface, camera_offset, scale=1):
+        # The layer is built for the full-resolution view and shrunk for lower render scales
+        width, height = surface.get_size()
+        size = (round(width / scale), round(height / scale))
+        if self.surface is None or self.size != size:
+            self.install(self.build(*size), size)
+        layer = self.surface
+        if scale != 1:
+            layer = self.scaled.get(scale)
+            if layer is None:
+                layer = self.scaled[scale] = scale_layer(self.surface, scaled_size(self.surface.get_size(), scale))
+            
+        period = layer.get_width()
+        x = -((camera_offset * self.parallax * scale) % period)
+        y = round(self.y * scale)
+        while x < width:
+            surface.blit(layer, (x, y))
+            x += period
+
+LAYER_COLORKEY = (255, 0, 255)
+GROUND_SEED = 1337
+GROUND_TILE = 60
+GRASS_TOP = GROUND_LEVEL - 8
+
+def make_layer_surface(width, height):
+    layer = pygame.Surface((width, height))
+    layer.fill(LAYER_COLORKEY)
+    layer.set_colorkey(LAYER_COLORKEY, pygame.RLEACCEL)
+    return layer
+
+def scaled_size(size, scale):
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+def scale_layer(surface, size):
+    scaled = pygame.transform.scale(surface, size)
+    colorkey = surface.get_colorkey()
+    if colorkey is not None:
+        scaled.set_colorkey(colorkey, pygame.RLEACCEL)
+    return scaled
+
+SCALED_SPRITES = SurfaceCache(SPRITE_CACHE_BYTES)
+
+def blit_sprite(surface, key, sprite, x, y, scale=1):
+    # Sprites are baked at full resolution; each render scale gets its own shrunk copy
+    if scale != 1:
+        sprite = SCALED_SPRITES.get((key, scale), lambda: scale_layer(sprite, scaled_size(sprite.get_size(), scale)))
+        x, y = x * scale, y * scale
+    return surface.blit(sprite, (x, y))
+
+def build_sky_layer(width, height):
+    layer = pygame.Surface((width, height))
+    layer.fill(BACKGROUND)
+    for i in range(height//2):
+        color_val = 140 + int(i/height*80)
+        pygame.draw.line(layer, (color_val, color_val, 255), 
+                       (0, i), (width, i))
+    return layer
+
+def build_mountain_layer(width, height):
+    w = width//4
+    period = width + w
+    layer = make_layer_surface(period, height)
     
     mountains = [
-        (0, HEIGHT//2, WIDTH//4, HEIGHT//3, 30),
-        (WIDTH//5, HEIGHT//2-20, WIDTH//4, HEIGHT//2.5, 50),
-        (WIDTH//1.8, HEIGHT//2, WIDTH//4, HEIGHT//3, 60)
+        (0, height//2, height//3),
+        (width//5, height//2-20, height//2.5),
+        (width//1.8, height//2, height//3)
     ]
     
-    for x, y, w, h, offset in mountains:
-        adjusted_x = (x - camera_offset * 0.1) % (WIDTH + w) - w
-        pygame.draw.polygon(surface, (100, 120, 160), [
-            (adjusted_x, y),
-            (adjusted_x + w//2, y - h),
-            (adjusted_x + w, y),
-            (adjusted_x + w, HEIGHT),
-            (adjusted_x, HEIGHT)
-        ])
-        pygame.draw.line(surface, BLACK, (adjusted_x, y), (adjusted_x + w//2, y - h), 2)
-        pygame.draw.line(surface, BLACK, (adjusted_x + w//2, y - h), (adjusted_x + w, y), 2)
-        
-    cloud_offset = (camera_offset * 0.2) % WIDTH
+    # Each mountain wraps around the tile so the strip scrolls seamlessly
+    for x, y, h in mountains:
+        for tile_x in (x - w, x - w + period):
+            pygame.draw.polygon(layer, (100, 120, 160), [
+                (tile_x, y),
+                (tile_x + w//2, y - h),
+                (tile_x + w, y),
+                (tile_x + w, height),
+                (tile_x, height)
+            ])
+            pygame.draw.line(layer, BLACK, (tile_x, y), (tile_x + w//2, y - h), 2)
+            pygame.draw.line(layer, BLACK, (tile_x + w//2, y - h), (tile_x + w, y), 2)
+    return layer
+
+def build_cloud_layer(width, height):
+    layer = make_layer_surface(width, height)
     clouds = [
-        (cloud_offset - 150, 50, 100, 40),
-        (cloud_offset, 80, 120, 35),
-        (cloud_offset + 200, 40, 90, 30)
+        (-150, 50, 100, 40),
+        (0, 80, 120, 35),
+        (200, 40, 90, 30)
     ]
     
     for x, y, w, h in clouds:
-        pygame.draw.ellipse(surface, (250, 250, 255), (x, y, w, h))
-        pygame.draw.ellipse(surface, (200, 200, 255), (x, y, w, h), 2)
+        for tile_x in (x, x + width):
+            pygame.draw.ellipse(layer, (250, 250, 255), (tile_x, y, w, h))
+            pygame.draw.ellipse(layer, (200, 200, 255), (tile_x, y, w, h), 2)
+    return layer
+
+BACKGROUND_LAYERS = [
+    BackgroundLayer(build_sky_layer, 0),
+    BackgroundLayer(build_mountain_layer, 0.1),
+    BackgroundLayer(build_cloud_layer, -0.2),
+]
+
+def draw_background(surface, camera_offset, scale=1):
+    for layer in BACKGROUND_LAYERS:
+        layer.draw(surface, camera_offset, scale)
 
-def draw_ground(surface, camera_offset):
-    pygame.draw.rect(surface, GROUND_COLOR, 
-                   (0 - camera_offset, GROUND_LEVEL, WIDTH*2, HEIGHT - GROUND_LEVEL))
+def build_ground_layer(width, height):
+    # The strip repeats every GROUND_TILE pixels and is at least one screen wide,
+    # so any camera position needs at most two blits
+    strip_width = math.ceil(width / GROUND_TILE) * GROUND_TILE
+    layer = make_layer_surface(strip_width, height - GRASS_TOP)
+    ground_y = GROUND_LEVEL - GRASS_TOP
+    rng = random.Random(GROUND_SEED)
     
-    pygame.draw.rect(surface, GREEN, 
-                   (0 - camera_offset, GROUND_LEVEL, WIDTH*2, 12))
+    pygame.draw.rect(layer, GROUND_COLOR, 
+                   (0, ground_y, strip_width, height - GROUND_LEVEL))
     
-    for i in range(0, WIDTH*2, 20):
-        height = random.randint(0, 5)
+    pygame.draw.rect(layer, GREEN, 
+                   (0, ground_y, strip_width, 12))
+    
+    for i in range(0, strip_width, 20):
+        tuft_height = rng.randint(0, 5)
         for j in range(4):
-            line_x = i - camera_offset + j * 4
-            pygame.draw.line(surface, GREEN, 
-                           (line_x, GROUND_LEVEL),
-                           (line_x, GROUND_LEVEL - height - j//2), 1)
+            line_x = i + j * 4
+            pygame.draw.line(layer, GREEN, 
+                           (line_x, ground_y),
+                           (line_x, ground_y - tuft_height - j//2), 1)
     
-    for i in range(0, WIDTH*2, 15):
-        x = i - camera_offset
-        pygame.draw.line(surface, (100, 60, 40), 
-                       (x, GROUND_LEVEL + 10), (x, GROUND_LEVEL + 40), 1)
+    for i in range(0, strip_width, 15):
+        pygame.draw.line(layer, (100, 60, 40), 
+                       (i, ground_y + 10), (i, ground_y + 40), 1)
+    return layer
+
+GROUND_LAYER = BackgroundLayer(build_ground_layer, 1, GRASS_TOP)
+
+def draw_ground(surface, camera_offset, scale=1):
+    GROUND_LAYER.draw(surface, camera_offset, scale)
 
-def draw_ui(surface, coins, lives):
+def draw_ui(surface, coins, lives, scale=1):
+    if scale != 1:
+        return [surface.blit(hud_layer(coins, lives, surface.get_size()), (0, 0))]
+    
     panel_y = 20
-    pygame.draw.rect(surface, (70, 40, 30, 220), 
+    panel = pygame.draw.rect(surface, (70, 40, 30, 220), 
                    (WIDTH//2 - 100, panel_y, 200, 50), 
                    border_radius=15)
     pygame.draw.rect(surface, BLACK, 
@@ -638,20 +1713,40 @@ def draw_ui(surface, coins, lives):
                         WIDTH//2 - 25, panel_y + 10, 
                         24, WHITE)
     
-    VectorFont.render_text(surface, f"x{lives}", 
-                        WIDTH//2 + 75, panel_y + 10, 
-                        24, WHITE)
+    lives_text = VectorFont.render_text(surface, f"x{lives}", 
+                                     WIDTH//2 + 75, panel_y + 10, 
+                                     24, WHITE)
     
     VectorFont.render_text(surface, "KOOP THE KOOPA", 
                         WIDTH//2 - 90, HEIGHT - 40, 
                         26, YELLOW)
     
+    # The run hint disappears after ten seconds, so its area is always reported
+    hint = pygame.Rect(WIDTH//2 - 85, HEIGHT - 95, 240, 30)
     if pygame.time.get_ticks() < 10000:
-        VectorFont.render_text(surface, "Hold SHIFT to run", 
-                            WIDTH//2 - 80, HEIGHT - 90, 
-                            18, WHITE)
+        hint = VectorFont.render_text(surface, "Hold SHIFT to run", 
+                                   WIDTH//2 - 80, HEIGHT - 90, 
+                                   18, WHITE)
+    return [panel.union(lives_text), hint]
 
-def draw_main_menu(surface, selection):
+def hud_layer(coins, lives, size=(WIDTH, HEIGHT)):
+    # The HUD drawn once per counter state into a single layer, for targets that cannot
+    # take its primitives directly: reduced render scales and textures
+    hint = pygame.time.get_ticks() < 10000
+    return SCREEN_LAYERS.get(('hud', coins, lives, hint, size), lambda: build_hud_layer(coins, lives, size))
+
+def build_hud_layer(coins, lives, size):
+    layer = make_layer_surface(WIDTH, HEIGHT)
+    draw_ui(layer, coins, lives)
+    return layer if size == (WIDTH, HEIGHT) else scale_layer(layer, size)
+
+MENU_OPTIONS = ("START GAME", "CONTROLS", "QUIT")
+BOOT_SEED = 20
+BOOT_BAR_RECT = ((WIDTH - 400) // 2, HEIGHT // 2 + 50, 400, 30)
+SCREEN_LAYERS = SurfaceCache(SCREEN_CACHE_BYTES)
+
+def build_menu_layer():
+    surface = pygame.Surface((WIDTH, HEIGHT))
     surface.fill(MENU_BG)
     
     for i in range(0, WIDTH, 40):
@@ -696,64 +1791,86 @@ def draw_main_menu(surface, selection):
     pygame.draw.polygon(surface, BANDANA_BLUE, bandana_points)
     pygame.draw.polygon(surface, BLACK, bandana_points, 2)
     
-    options = [
-        "START GAME",
-        "CONTROLS",
-        "QUIT"
-    ]
-    
-    for i, option in enumerate(options):
-        y_pos = HEIGHT//2 + 120 + i * 50
-        color = WHITE if i != selection else YELLOW
-        
-        if i == selection:
-            pygame.draw.rect(surface, MENU_HIGHLIGHT, 
-                          (WIDTH//2 - 110, y_pos - 25, 220, 40), 
-                          border_radius=10)
-            pygame.draw.rect(surface, BLACK, 
-                          (WIDTH//2 - 110, y_pos - 25, 220, 40), 
-                          3, border_radius=10)
-        
-        VectorFont.render_text(surface, option, 
-                            WIDTH//2 - 80, y_pos - 10, 
-                            30, color)
+    for i, option in enumerate(MENU_OPTIONS):
+        VectorFont.render_text(surface, option, WIDTH//2 - 80, HEIGHT//2 + 110 + i * 50, 30, WHITE)
     
     VectorFont.render_text(surface, "© 2023 KOOPA STUDIOS", 
                         WIDTH//2 - 120, HEIGHT - 30, 
                         20, WHITE)
+    return surface
 
-def draw_boot_screen(surface, progress):
+def build_menu_frame(selection):
+    # The static menu with one option highlighted; there are only three, so each is kept whole
+    surface = SCREEN_LAYERS.get('menu', build_menu_layer).copy()
+    y_pos = HEIGHT//2 + 120 + selection * 50
+    pygame.draw.rect(surface, MENU_HIGHLIGHT, 
+                  (WIDTH//2 - 110, y_pos - 25, 220, 40), 
+                  border_radius=10)
+    pygame.draw.rect(surface, BLACK, 
+                  (WIDTH//2 - 110, y_pos - 25, 220, 40), 
+                  3, border_radius=10)
+    VectorFont.render_text(surface, MENU_OPTIONS[selection], 
+                        WIDTH//2 - 80, y_pos - 10, 
+                        30, YELLOW)
+    # The bottom highlight reaches under the footer, which has to stay on top
+    VectorFont.render_text(surface, "© 2023 KOOPA STUDIOS", 
+                        WIDTH//2 - 120, HEIGHT - 30, 
+                        20, WHITE)
+    return surface
+
+def draw_main_menu(surface, selection):
+    surface.blit(SCREEN_LAYERS.get(('menu', selection), lambda: build_menu_frame(selection)), (0, 0))
+
+def build_boot_layer():
+    surface = pygame.Surface((WIDTH, HEIGHT))
     surface.fill((30, 30, 60))
     
-    bar_width = 400
-    bar_height = 30
-    bar_x = (WIDTH - bar_width) // 2
-    bar_y = HEIGHT // 2 + 50
-    
+    bar_x, bar_y, bar_width, bar_height = BOOT_BAR_RECT
     pygame.draw.rect(surface, (60, 60, 100), 
                    (bar_x, bar_y, bar_width, bar_height))
     pygame.draw.rect(surface, BLACK, 
                    (bar_x, bar_y, bar_width, bar_height), 3)
     
-    fill_width = int(bar_width * progress)
-    pygame.draw.rect(surface, BLUE, 
-                   (bar_x, bar_y, fill_width, bar_height))
-    
     VectorFont.render_text(surface, "LOADING KOOPA ENGINE...", 
                         WIDTH//2 - 180, HEIGHT//2 - 30, 
                         36, WHITE)
     
+    # A fixed scatter of bubbles rather than a fresh random one every frame
+    rng = random.Random(BOOT_SEED)
+    for i in range(20):
+        size = rng.randint(5, 15)
+        x = rng.randint(0, WIDTH)
+        y = rng.randint(0, HEIGHT//2 - 50)
+        pygame.draw.circle(surface, (100, 100, 200), (x, y), size)
+        pygame.draw.circle(surface, (70, 70, 180), (x, y), size, 1)
+    return surface
+
+def draw_boot_screen(surface, progress):
+    surface.blit(SCREEN_LAYERS.get('boot', build_boot_layer), (0, 0))
+    
+    bar_x, bar_y, bar_width, bar_height = BOOT_BAR_RECT
+    fill_width = int(bar_width * progress)
+    pygame.draw.rect(surface, BLUE, 
+                   (bar_x, bar_y, fill_width, bar_height))
+    
     percent = int(progress * 100)
     VectorFont.render_text(surface, f"{percent}%", 
                         WIDTH//2 - 30, bar_y + bar_height + 20, 
                         24, WHITE)
-    
-    for i in range(20):
-        size = random.randint(5, 15)
-        x = random.randint(0, WIDTH)
-        y = random.randint(0, HEIGHT//2 - 50)
-        pygame.draw.circle(surface, (100, 100, 200), (x, y), size)
-        pygame.draw.circle(surface, (70, 70, 180), (x, y), size, 1)
+
+def build_game_over_layer():
+    surface = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+    surface.fill((0, 0, 0, 150))
+    VectorFont.render_text(surface, "GAME OVER", 
+                        WIDTH//2 - 100, HEIGHT//2 - 50, 
+                        50, RED, WHITE, 5)
+    VectorFont.render_text(surface, "PRESS R TO RESTART", 
+                        WIDTH//2 - 140, HEIGHT//2 + 30, 
+                        28, YELLOW)
+    return surface
+
+def draw_game_over(surface):
+    return surface.blit(SCREEN_LAYERS.get('game_over', build_game_over_layer), (0, 0))
 
 def create_stage():
     platforms = [
@@ -785,32 +1902,1048 @@ def create_stage():
     
     return platforms, coins, goombas
 
-def main():
+def endless_chunk(index, seed=None):
+    # Procedural chunks for a stage with no right-hand end, the same for a given seed
+    if index < 0:
+        return None
+    rng = random.Random(f"{seed}:{index}")
+    palette = [LIGHT_BROWN, (200, 150, 100), (150, 200, 150), (180, 160, 130)]
+    left = index * CHUNK_WIDTH
+    chunk = LevelChunk([], [], [])
+    for slot in range(CHUNK_WIDTH // 256):
+        x = left + slot * 256 + rng.randrange(0, 120)
+        y = GROUND_LEVEL - rng.choice((80, 120, 160, 200, 220))
+        if rng.random() < 0.2:
+            chunk.platforms.append(PlatformSpec(x, y, 140, 20, (180, 160, 130), False, True))
+        else:
+            chunk.platforms.append(PlatformSpec(x, y, rng.choice((70, 80, 100, 110, 120)), 20,
+                                                rng.choice(palette), False, False))
+        chunk.coins.append(CoinSpec(x + 20, y - 30))
+        # Keep the spawn point clear of spikes and Goombas
+        if x < 800:
+            continue
+        if rng.random() < 0.3:
+            chunk.platforms.append(PlatformSpec(x + 130, GROUND_LEVEL - 40, 80, 20, LIGHT_BROWN, True, False))
+        elif rng.random() < 0.5:
+            chunk.goombas.append(GoombaSpec(x + 100, GROUND_LEVEL, rng.choice((60, 100, 150))))
+    return chunk
+
+class Level:
+    def __init__(self, source, chunk_width=CHUNK_WIDTH, width=None, chunk_range=None, resource=None):
+        # source(index) returns the LevelChunk covering [index * chunk_width, (index + 1) * chunk_width), or None;
+        # resource, if given, is what source reads from and is closed along with the level
+        self.source = source
+        self.chunk_width = chunk_width
+        self.width = width
+        self.chunk_range = chunk_range
+        self.resource = resource
+        # Recently decoded chunks; the boot loader fills this from worker threads
+        self.specs = OrderedDict()
+        self.lock = threading.Lock()
+        
+    def chunk(self, index):
+        with self.lock:
+            if index in self.specs:
+                self.specs.move_to_end(index)
+                return self.specs[index]
+        spec = self.source(index)
+        with self.lock:
+            self.specs[index] = spec
+            while len(self.specs) > CHUNK_SPEC_CACHE:
+                self.specs.popitem(last=False)
+        return spec
+    
+    def close(self):
+        if self.resource is not None:
+            self.resource.close()
+            
+    @classmethod
+    def from_entities(cls, platforms, coins, goombas, chunk_width=CHUNK_WIDTH):
+        chunks = {}
+        right = max([platform.position.x + platform.size.width for platform in platforms] +
+                    [goomba.start_x + goomba.walk_range + goomba.size.width for goomba in goombas] +
+                    [coin.position.x for coin in coins] + [WIDTH])
+        
+        def bucket(x):
+            return chunks.setdefault(int(x // chunk_width), LevelChunk([], [], []))
+        
+        for platform in platforms:
+            bucket(platform.position.x).platforms.append(PlatformSpec(
+                *platform.position, *platform.size, platform.color, platform.is_spike, platform.is_cloud))
+        for coin in coins:
+            bucket(coin.position.x).coins.append(CoinSpec(*coin.position))
+        for goomba in goombas:
+            bucket(goomba.start_x).goombas.append(GoombaSpec(goomba.start_x, goomba.position.y, goomba.walk_range))
+        chunk_range = range(min(chunks), max(chunks) + 1) if chunks else range(0)
+        return cls(chunks.get, chunk_width, right + WIDTH//4, chunk_range)
+
+class LevelFile:
+    # Header, then one index entry per chunk from `first` on, then each chunk's fixed-width records
+    # back to back. Everything is little-endian; a width of -1 means the stage has no right-hand end.
+    MAGIC = b'KOOPLVL1'
+    HEADER = struct.Struct('<8sIiIi')
+    ENTRY = struct.Struct('<QIII')
+    PLATFORM = struct.Struct('<iiHH4B')
+    COIN = struct.Struct('<ii')
+    GOOMBA = struct.Struct('<iii')
+    SPIKE, CLOUD = 1, 2
+    
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # mmap refuses empty files, so a file too short for the header is turned away before mapping
+            if os.fstat(f.fileno()).st_size < self.HEADER.size:
+                raise ValueError(f"{path} is not a Koopa level")
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.chunk_width, self.first, self.count, width = self.HEADER.unpack_from(self.data)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a Koopa level")
+        if len(self.data) < self.HEADER.size + self.count * self.ENTRY.size:
+            self.close()
+            raise ValueError(f"{path} is truncated: its chunk index is incomplete")
+        self.width = None if width < 0 else width
+        
+    def close(self):
+        self.data.close()
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+        
+    def chunk(self, index):
+        # Only the pages holding this chunk's index entry and records are touched
+        if not self.first <= index < self.first + self.count:
+            return None
+        offset, platforms, coins, goombas = self.ENTRY.unpack_from(
+            self.data, self.HEADER.size + (index - self.first) * self.ENTRY.size)
+        end = offset + platforms * self.PLATFORM.size + coins * self.COIN.size + goombas * self.GOOMBA.size
+        if end > len(self.data):
+            raise ValueError(f"chunk {index} runs past the end of the level file")
+        
+        view = memoryview(self.data)
+        chunk = LevelChunk([], [], [])
+        end = offset + platforms * self.PLATFORM.size
+        for x, y, width, height, r, g, b, flags in self.PLATFORM.iter_unpack(view[offset:end]):
+            chunk.platforms.append(PlatformSpec(x, y, width, height, Color(r, g, b),
+                                                bool(flags & self.SPIKE), bool(flags & self.CLOUD)))
+        offset, end = end, end + coins * self.COIN.size
+        chunk.coins.extend(CoinSpec(*coin) for coin in self.COIN.iter_unpack(view[offset:end]))
+        offset, end = end, end + goombas * self.GOOMBA.size
+        chunk.goombas.extend(GoombaSpec(*goomba) for goomba in self.GOOMBA.iter_unpack(view[offset:end]))
+        view.release()
+        return chunk
+    
+    def level(self):
+        return Level(self.chunk, self.chunk_width, self.width, range(self.first, self.first + self.count), self)
+    
+    @classmethod
+    def write(cls, path, level, chunk_range=None):
+        chunk_range = chunk_range if chunk_range is not None else level.chunk_range
+        if chunk_range is None:
+            raise ValueError("the level has no end; pass the range of chunks to write")
+        
+        width = -1 if level.width is None else int(level.width)
+        index = []
+        offset = cls.HEADER.size + len(chunk_range) * cls.ENTRY.size
+        with open(path, 'wb') as f:
+            # Records are streamed out chunk by chunk, then the index is filled in behind them
+            f.write(cls.HEADER.pack(cls.MAGIC, level.chunk_width, chunk_range.start, len(chunk_range), width))
+            f.seek(offset)
+            for i in chunk_range:
+                chunk = level.chunk(i) or LevelChunk([], [], [])
+                data = b''.join(
+                    [cls.PLATFORM.pack(int(p.x), int(p.y), p.width, p.height, *p.color[:3],
+                                       cls.SPIKE * p.is_spike | cls.CLOUD * p.is_cloud) for p in chunk.platforms] +
+                    [cls.COIN.pack(int(c.x), int(c.y)) for c in chunk.coins] +
+                    [cls.GOOMBA.pack(int(g.x), int(g.y), int(g.walk_range)) for g in chunk.goombas])
+                index.append(cls.ENTRY.pack(offset, len(chunk.platforms), len(chunk.coins), len(chunk.goombas)))
+                f.write(data)
+                offset += len(data)
+            f.seek(cls.HEADER.size)
+            f.writelines(index)
+
+def stage_name(stage):
+    # Level files are named by absolute path, so a recording made on one replays from any directory
+    return stage if stage in ('default', 'endless') else os.path.abspath(stage)
+
+def create_level(stage='default', seed=None):
+    # `stage` is 'default', 'endless' or the path of a level file
+    if stage == 'endless':
+        return Level(lambda index: endless_chunk(index, seed))
+    if stage == 'default':
+        return Level.from_entities(*create_stage())
+    return LevelFile(stage).level()
+
+class ChunkStreamer:
+    def __init__(self, level, margin=CHUNK_MARGIN):
+        self.level = level
+        self.margin = margin
+        self.platform_index = SpatialHash()
+        # Live coins and Goombas only; they leave their index when collected or crushed
+        self.coin_index = SpatialHash()
+        self.goomba_index = SpatialHash()
+        self.loaded = {}
+        self.active = []
+        self.window = None
+        # Coins collected and Goombas crushed in evicted chunks, so they stay gone when streamed back in
+        self.cleared = {}
+        self.platforms, self.coins, self.goombas = [], [], []
+        self.coin_batch = CoinBatch(self.coins)
+        self.goomba_batch = GoombaBatch(self.goombas)
+        self.loads = 0
+        self.evictions = 0
+        
+    def __len__(self):
+        return sum(chunk is not None for chunk in self.loaded.values())
+    
+    # Chunks overlapping the camera window plus `margin` either side are simulated and drawn;
+    # one more chunk either side is kept loaded but idle so walking back and forth doesn't thrash
+    def update(self, camera_offset):
+        width = self.level.chunk_width
+        first = int(camera_offset // width) - self.margin
+        last = int((camera_offset + WIDTH) // width) + self.margin
+        if (first, last) == self.window:
+            return
+        self.window = (first, last)
+        
+        for index in [index for index in self.loaded if not first - 1 <= index <= last + 1]:
+            self.evict(index)
+        for index in range(first - 1, last + 2):
+            if index not in self.loaded:
+                self.load(index)
+                
+        active = [index for index in range(first, last + 1) if self.loaded[index] is not None]
+        if active != self.active:
+            self.activate(active)
+            
+    def load(self, index):
+        spec = self.level.chunk(index)
+        if spec is None:
+            self.loaded[index] = None
+            return
+        
+        chunk = LevelChunk([Platform(*platform) for platform in spec.platforms],
+                           [Coin(*coin) for coin in spec.coins],
+                           [Goomba(*goomba) for goomba in spec.goombas])
+        collected, crushed = self.cleared.pop(index, ((), ()))
+        for i in collected:
+            chunk.coins[i].collected = True
+        for i in crushed:
+            chunk.goombas[i].crushed = True
+        self.loaded[index] = chunk
+        self.loads += 1
+        
+    def evict(self, index):
+        chunk = self.loaded.pop(index)
+        if chunk is None:
+            return
+        
+        if index in self.active:
+            self.unindex(chunk)
+        collected = [i for i, coin in enumerate(chunk.coins) if coin.collected]
+        crushed = [i for i, goomba in enumerate(chunk.goombas) if goomba.crushed]
+        if collected or crushed:
+            self.cleared[index] = (collected, crushed)
+        self.evictions += 1
+        
+    def index(self, chunk):
+        for platform in chunk.platforms:
+            self.platform_index.insert(platform, *platform.position, *platform.size)
+        for coin in chunk.coins:
+            if not coin.collected:
+                self.coin_index.insert(coin, *coin.position, 0, 0)
+        for goomba in chunk.goombas:
+            if not goomba.crushed:
+                self.goomba_index.insert(goomba, *goomba.patrol_bounds())
+                
+    def unindex(self, chunk):
+        for platform in chunk.platforms:
+            self.platform_index.remove(platform)
+        for coin in chunk.coins:
+            self.coin_index.remove(coin)
+        for goomba in chunk.goombas:
+            self.goomba_index.remove(goomba)
+            
+    def activate(self, active):
+        for index in self.active:
+            if index not in active and index in self.loaded:
+                self.unindex(self.loaded[index])
+        for index in active:
+            if index not in self.active:
+                self.index(self.loaded[index])
+        self.active = active
+        
+        # The new batch starts from the Goombas' own positions, so bring them up to date first
+        self.goomba_batch.sync_all()
+        chunks = [self.loaded[index] for index in active]
+        self.platforms = [platform for chunk in chunks for platform in chunk.platforms]
+        self.coins = [coin for chunk in chunks for coin in chunk.coins]
+        self.goombas = [goomba for chunk in chunks for goomba in chunk.goombas]
+        self.coin_batch = CoinBatch(self.coins)
+        self.goomba_batch = GoombaBatch(self.goombas)
+        
+    def collect(self, coin):
+        self.coin_batch.collect(coin)
+        self.coin_index.remove(coin)
+        
+    def crush(self, goomba):
+        self.goomba_batch.crush(goomba)
+        self.goomba_index.remove(goomba)
+
+class World:
+    def __init__(self, seed=None, stage='default'):
+        self.seed = seed
+        self.stage = stage
+        self.level = create_level(stage, seed)
+        self.rng = random.Random(seed)
+        self.camera = Camera()
+        self.dialog = DialogBox("JUMP ON ENEMIES TO DEFEAT THEM! WATCH OUT FOR SPIKES!", 
+                               WIDTH//2 - 250, 100, 500, 80)
+        self.particle_system = ParticleSystem(seed=seed)
+        self.profiler = FrameProfiler()
+        self.culling = {}
+        self.ticks = 0
+        self.reset()
+        
+    def reset(self):
+        self.streamer = ChunkStreamer(self.level)
+        self.streamer.update(self.camera.offset)
+        self.koops = Koops(400, GROUND_LEVEL - 100, self.rng)
+        self.collected_coins = 0
+        self.lives = 3
+        
+    def close(self):
+        self.level.close()
+        
+    @property
+    def platforms(self):
+        return self.streamer.platforms
+    
+    @property
+    def coins(self):
+        return self.streamer.coins
+    
+    @property
+    def goombas(self):
+        return self.streamer.goombas
+    
+    @property
+    def platform_index(self):
+        return self.streamer.platform_index
+    
+    @property
+    def now(self):
+        return self.ticks * 1000 // SIM_RATE
+    
+    def digest(self):
+        # Fingerprint of the simulation state, for checking that a replay matched its recording
+        koops = self.koops
+        self.streamer.goomba_batch.sync_all()
+        state = (self.ticks, koops.position, koops.velocity_y, koops.hit_points,
+                 self.collected_coins, self.lives, len(self.particle_system),
+                 [(goomba.position, goomba.crushed) for goomba in self.goombas],
+                 [coin.collected for coin in self.coins])
+        return hashlib.sha1(repr(state).encode()).hexdigest()[:16]
+    
+    def step(self, controls):
+        now = self.now
+        self.ticks += 1
+        koops = self.koops
+        particle_system = self.particle_system
+        
+        if controls.jump:
+            koops.jump()
+        if controls.crouch != koops.crouching:
+            koops.crouch(controls.crouch)
+        koops.run(controls.run)
+        
+        self.camera.update(koops.position.x)
+        self.streamer.update(self.camera.offset)
+        
+        koops.previous_position.set(koops.position.x, koops.position.y)
+        koops.move(controls.dx, self.platform_index, self.streamer.level.width)
+        
+        koops.update(self.platform_index, now)
+        self.profiler.lap('koops')
+        self.dialog.update()
+        particle_system.update()
+        self.profiler.lap('particles')
+        
+        streamer = self.streamer
+        streamer.coin_batch.update(now)
+        radius = COIN_PICKUP_RADIUS
+        for coin in streamer.coin_index.query(koops.position.x - radius, koops.position.y - radius,
+                                              2 * radius, 2 * radius):
+            dx = koops.position.x - coin.position.x
+            dy = koops.position.y - coin.position.y
+            if dx * dx + dy * dy < radius * radius:
+                streamer.collect(coin)
+                self.collected_coins += 1
+                particle_system.add_particles(coin.position, 10, YELLOW)
+        
+        streamer.goomba_batch.update(now)
+        contacts = streamer.goomba_index.query(koops.position.x, koops.position.y,
+                                               koops.size.width, koops.size.height)
+        streamer.goomba_batch.sync_goombas(contacts)
+        for goomba in contacts:
+            if not goomba.crushed:
+                if (koops.position.x + koops.size.width > goomba.position.x + 5 and 
+                    koops.position.x < goomba.position.x + goomba.size.width - 5 and
+                    koops.position.y + koops.size.height - 5 > goomba.position.y and
+                    koops.position.y < goomba.position.y + goomba.size.height):
+                    
+                    if koops.position.y + koops.size.height < goomba.position.y + 10 and koops.velocity_y > 0:
+                        streamer.crush(goomba)
+                        koops.velocity_y = -JUMP_POWER * 0.7
+                        particle_system.add_particles(goomba.position, 15, BROWN)
+                    elif koops.invincible == 0:
+                        koops.damage()
+        
+        for platform in self.platform_index.query(koops.position.x, koops.position.y,
+                                                  koops.size.width, koops.size.height):
+            if platform.is_spike:
+                if (koops.position.x + koops.size.width > platform.position.x and 
+                    koops.position.x < platform.position.x + platform.size.width and
+                    koops.position.y + koops.size.height > platform.position.y and
+                    koops.position.y < platform.position.y + platform.size.height):
+                    koops.damage()
+                    koops.velocity_y = -8
+                    if koops.position.x < platform.position.x + platform.size.width//2:
+                        koops.position.x = platform.position.x - koops.size.width - 5
+                    else:
+                        koops.position.x = platform.position.x + platform.size.width + 5
+                    particle_system.add_particles(koops.position, 15, RED, (-3, 3), (-5, -3), 25)
+        
+        if koops.hit_points <= 0:
+            self.lives -= 1
+            koops.hit_points = 3
+            koops.position.set(self.camera.offset + WIDTH//2, GROUND_LEVEL - 100)
+            koops.previous_position.set(koops.position.x, koops.position.y)
+            koops.velocity_y = 0
+        self.profiler.lap('collisions')
+            
+    def draw(self, surface, alpha=1.0):
+        # The target's width sets the render scale; culling stays in full-resolution coordinates
+        scale = surface.get_width() / WIDTH
+        profiler = self.profiler
+        camera_offset = self.camera.interpolated(alpha)
+        draw_background(surface, camera_offset, scale)
+        profiler.lap('background')
+        draw_ground(surface, camera_offset, scale)
+        profiler.lap('ground')
+        
+        platforms, coins, goombas = self.visible(camera_offset)
+        for platform in platforms:
+            platform.draw(surface, camera_offset, scale)
+        
+        dirty = []
+        for coin in coins:
+            dirty.append(coin.draw(surface, camera_offset, scale))
+        for goomba in goombas:
+            dirty.append(goomba.draw(surface, camera_offset, alpha, scale))
+        
+        dirty.append(self.koops.draw(surface, camera_offset, alpha, scale))
+        profiler.lap('entities')
+        dirty.append(self.particle_system.draw(surface, camera_offset, scale))
+        profiler.lap('particles')
+        
+        self.count_culled(platforms, coins, goombas)
+        dirty.extend(draw_ui(surface, self.collected_coins, self.lives, scale))
+        dirty.append(self.dialog.draw(surface, scale))
+        profiler.lap('ui')
+        return dirty
+    
+    def draw_textures(self, textures, alpha=1.0):
+        # The same frame as draw(), built from texture copies; only the particles are still
+        # rasterized on the CPU, into a layer that is uploaded when it changes
+        profiler = self.profiler
+        camera_offset = self.camera.interpolated(alpha)
+        draw_background(textures, camera_offset)
+        profiler.lap('background')
+        draw_ground(textures, camera_offset)
+        profiler.lap('ground')
+        
+        platforms, coins, goombas = self.visible(camera_offset)
+        for platform in platforms:
+            platform.draw(textures, camera_offset)
+        ox, oy = COIN_SPRITE_ORIGIN
+        for coin in coins:
+            textures.blit(coin.sprite(), (coin.position.x - camera_offset - ox,
+                                          coin.position.y + coin.animation_offset - oy))
+        for goomba in goombas:
+            goomba.draw(textures, camera_offset, alpha)
+        self.koops.draw(textures, camera_offset, alpha)
+        profiler.lap('entities')
+        textures.particles.draw(lambda surface: self.particle_system.draw(surface, camera_offset))
+        profiler.lap('particles')
+        
+        self.count_culled(platforms, coins, goombas)
+        textures.blit(hud_layer(self.collected_coins, self.lives), (0, 0))
+        self.dialog.draw_textures(textures)
+        profiler.lap('ui')
+        
+    def visible(self, camera_offset):
+        # Only what overlaps the camera window reaches a draw call
+        streamer = self.streamer
+        pad = PLATFORM_SPRITE_MARGIN + CLOUD_FLUFF_EXTENT
+        platforms = streamer.platform_index.query(camera_offset - pad, 0, WIDTH + 2 * pad, HEIGHT)
+        coins = streamer.coin_index.query(camera_offset - CULL_MARGIN, 0, WIDTH + 2 * CULL_MARGIN, HEIGHT)
+        batch = streamer.goomba_batch
+        left, right = camera_offset - CULL_MARGIN, camera_offset + WIDTH + CULL_MARGIN
+        visible = np.flatnonzero((batch.x > left) & (batch.x < right)).tolist()
+        batch.sync(visible)
+        # Crushed Goombas lie flat, so they go under the live ones
+        goombas = [goomba for goomba in batch.crushed if left < goomba.position.x < right]
+        goombas.extend(batch.goombas[index] for index in visible)
+        return platforms, coins, goombas
+    
+    def count_culled(self, platforms, coins, goombas):
+        streamer = self.streamer
+        particle_system = self.particle_system
+        self.culling = {
+            'platforms': (len(platforms), len(streamer.platforms) - len(platforms)),
+            'coins': (len(coins), len(streamer.coin_batch.live) - len(coins)),
+            'goombas': (len(goombas), len(streamer.goomba_batch) - len(goombas)),
+            'particles': (particle_system.drawn, len(particle_system) - particle_system.drawn),
+        }
+
+class AssetLoader:
+    # Warms the caches the first seconds of gameplay will hit: background layers, the sprites of the
+    # platforms around the spawn point, Koops and Goomba frames and the HUD glyphs. The worker thread only
+    # decodes chunks and draws onto fresh surfaces; results go into the shared caches on the main thread.
+    # pygame.draw holds the GIL, so there is one worker: it keeps the boot screen animating while the
+    # work is done, and more threads would not get it done any sooner.
+    HUD_TEXT = (("x0123456789", 24, WHITE), ("KOOP THE KOOPA", 26, YELLOW), ("Hold SHIFT to run", 18, WHITE))
+    
+    def __init__(self, world, size=(WIDTH, HEIGHT)):
+        self.world = world
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.tasks = []
+        self.done = 0
+        
+        for layer in BACKGROUND_LAYERS + [GROUND_LAYER]:
+            self.submit(lambda surface, layer=layer, size=size: layer.install(surface, size), layer.build, *size)
+            
+        level = world.level
+        first = int(world.camera.offset // level.chunk_width) - CHUNK_MARGIN - 1
+        last = int((world.camera.offset + size[0]) // level.chunk_width) + CHUNK_MARGIN + 1 + BOOT_LOOKAHEAD
+        for index in range(first, last + 1):
+            self.submit(self.install_sprites, self.bake_chunk, level, index)
+            
+        for frame in self.koops_frames():
+            self.submit(lambda sprite, frame=frame: Koops.frame_cache.get(frame, lambda: sprite), Koops.bake, frame)
+        for crushed in (False, True):
+            for offset in range(-2, 3):
+                frame = GoombaFrame(GOOMBA_SIZE, crushed, offset, 0)
+                self.submit(lambda sprite, frame=frame: Goomba.frame_cache.get(frame, lambda: sprite),
+                            Goomba.bake, frame)
+                
+        for text, text_size, color in self.HUD_TEXT + ((world.dialog.text, 22, BLACK),):
+            for char in sorted(set(text)):
+                char = char if char in CHAR_DEFINITIONS else '?'
+                key = (char, text_size, tuple(color), tuple(BLACK), 2)
+                self.submit(lambda glyph, key=key: VectorFont.glyph_cache.get(key, lambda: glyph),
+                            VectorFont.build_glyph, char, text_size, color, BLACK, 2)
+        self.total = len(self.tasks) + 1
+        
+    def submit(self, install, build, *args):
+        self.tasks.append((self.pool.submit(build, *args), install))
+        
+    @staticmethod
+    def prime(result):
+        # SDL sets up a blit (and RLE-encodes colorkeyed layers) the first time a surface is drawn
+        # to the screen; doing it during boot keeps that cost out of the first gameplay frame
+        screen = pygame.display.get_surface()
+        if screen is None:
+            return
+        for surface in (result.values() if isinstance(result, dict) else (result,)):
+            screen.blit(surface, (0, 0))
+            
+        
+    @staticmethod
+    def bake_chunk(level, index):
+        spec = level.chunk(index)
+        sprites = {}
+        for platform in (spec.platforms if spec is not None else ()):
+            platform = Platform(*platform)
+            key = platform.sprite_key()
+            if key not in sprites:
+                sprites[key] = platform.bake()
+        return sprites
+    
+    @staticmethod
+    def install_sprites(sprites):
+        for key, sprite in sprites.items():
+            Platform.sprite_cache.get(key, lambda: sprite)
+            
+    @staticmethod
+    def koops_frames():
+        # Every frame an idle Koops shows over the first BOOT_WARM_TICKS ticks, facing either way
+        koops = Koops(0, 0)
+        frames = set()
+        for tick in range(BOOT_WARM_TICKS):
+            koops.animate(tick * 1000 // SIM_RATE)
+            for direction in (1, -1):
+                koops.direction = direction
+                frames.add(koops.frame())
+        return frames
+    
+    @property
+    def progress(self):
+        return self.done / self.total
+    
+    @property
+    def finished(self):
+        return self.done == self.total
+    
+    def poll(self):
+        pending = []
+        for future, install in self.tasks:
+            if future.done():
+                result = future.result()
+                install(result)
+                self.prime(result)
+                self.done += 1
+            else:
+                pending.append((future, install))
+        self.tasks = pending
+        
+        # HUD strings are composed from the installed glyphs, so they come last and on this thread
+        if not pending and not self.finished:
+            world = self.world
+            for text, size, color in (("KOOP THE KOOPA", 26, YELLOW), ("Hold SHIFT to run", 18, WHITE),
+                                      (f"x{world.collected_coins}", 24, WHITE), (f"x{world.lives}", 24, WHITE)):
+                VectorFont.text_surface(text, size, color)
+            self.done += 1
+            self.pool.shutdown(wait=False)
+        return self.progress
+
+def demo_script(tick):
+    # Walk back and forth across the stage, hopping and sprinting now and then
+    dx = 1 if (tick // 240) % 2 == 0 else -1
+    return Controls(dx=dx, jump=tick % 45 == 0, crouch=(tick // 600) % 5 == 4,
+                    run=(tick // 120) % 3 == 0)
+
+class InputRecording:
+    # The header is followed by the stage name in UTF-8, then the compressed tick bytes
+    MAGIC = b'KOOPREC2'
+    HEADER = struct.Struct('<8sqIH')
+    JUMP, CROUCH, RUN, RESTART = 4, 8, 16, 32
+    
+    def __init__(self, seed, data=b'', stage='default'):
+        self.seed = seed
+        self.data = bytearray(data)
+        self.stage = stage_name(stage)
+        
+    def __len__(self):
+        return len(self.data)
+    
+    # One byte per tick: bits 0-1 hold dx + 1, then jump, crouch, run and restart flags
+    def record(self, controls, restart=False):
+        code = controls.dx + 1
+        if controls.jump:
+            code |= self.JUMP
+        if controls.crouch:
+            code |= self.CROUCH
+        if controls.run:
+            code |= self.RUN
+        if restart:
+            code |= self.RESTART
+        self.data.append(code)
+        
+    def controls(self, tick):
+        code = self.data[tick]
+        controls = Controls(dx=(code & 3) - 1, jump=bool(code & self.JUMP),
+                            crouch=bool(code & self.CROUCH), run=bool(code & self.RUN))
+        return controls, bool(code & self.RESTART)
+    
+    def replay_stage(self, stage=None):
+        # The stage the recording was made on; asking for any other one is an error, not a silent desync
+        if stage is not None and stage_name(stage) != self.stage:
+            raise ValueError(f"the recording was made on stage {self.stage!r}, not {stage!r}")
+        return self.stage
+    
+    def save(self, path):
+        stage = self.stage.encode()
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.seed, len(self.data), len(stage)))
+            f.write(stage)
+            f.write(zlib.compress(bytes(self.data), 9))
+            
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            header = f.read(cls.HEADER.size)
+            if len(header) < cls.HEADER.size or header[:len(cls.MAGIC)] != cls.MAGIC:
+                raise ValueError(f"{path} is not a Koopa input recording")
+            magic, seed, length, stage_length = cls.HEADER.unpack(header)
+            stage = f.read(stage_length).decode()
+            data = zlib.decompress(f.read())
+        if len(data) != length:
+            raise ValueError(f"{path} is truncated: expected {length} ticks, found {len(data)}")
+        return cls(seed, data, stage)
+
+def run_headless(frames, script=demo_script, seed=None, recording=None, stage='default'):
+    world = World(seed, stage)
+    restarts = 0
+    
+    start = time.perf_counter()
+    for tick in range(frames):
+        # Restart at the start of the tick after a game over, the point a replay applies it, so a
+        # game over on the final tick leaves the world as the recording will reproduce it
+        restart = world.lives <= 0
+        if restart:
+            world.reset()
+            restarts += 1
+        controls = script(tick)
+        if recording is not None:
+            recording.record(controls, restart)
+        world.step(controls)
+    elapsed = time.perf_counter() - start
+    world.close()
+    
+    return {
+        'frames': frames,
+        'seconds': elapsed,
+        'fps': frames / elapsed if elapsed > 0 else float('inf'),
+        'coins': world.collected_coins,
+        'lives': world.lives,
+        'restarts': restarts,
+        'particles': len(world.particle_system),
+        'digest': world.digest(),
+    }
+
+def replay_headless(recording, stage=None):
+    world = World(recording.seed, recording.replay_stage(stage))
+    restarts = 0
+    
+    start = time.perf_counter()
+    for tick in range(len(recording)):
+        controls, restart = recording.controls(tick)
+        if restart:
+            world.reset()
+            restarts += 1
+        world.step(controls)
+    elapsed = time.perf_counter() - start
+    world.close()
+    
+    return {
+        'frames': len(recording),
+        'seconds': elapsed,
+        'fps': len(recording) / elapsed if elapsed > 0 else float('inf'),
+        'coins': world.collected_coins,
+        'lives': world.lives,
+        'restarts': restarts,
+        'particles': len(world.particle_system),
+        'digest': world.digest(),
+    }
+
+def playtest_script(seed):
+    # A seeded variation on demo_script, so every batch session plays differently but repeatably
+    rng = random.Random(seed)
+    walk = rng.randrange(120, 480)
+    hop = rng.randrange(20, 70)
+    sprint = rng.randrange(60, 240)
+    backtrack = rng.choice((2, 3, 4))
+    
+    def script(tick):
+        dx = -1 if (tick // walk) % backtrack == backtrack - 1 else 1
+        return Controls(dx=dx, jump=tick % hop == 0, crouch=False, run=(tick // sprint) % 2 == 0)
+    return script
+
+def run_session(seed, frames, stage='default'):
+    # One playtest: play until the last life is lost or `frames` ticks have passed
+    world = World(seed, stage)
+    script = playtest_script(seed)
+    lives = world.lives
+    survived = 0
+    
+    start = time.perf_counter()
+    for tick in range(frames):
+        world.step(script(tick))
+        survived += 1
+        if world.lives <= 0:
+            break
+    elapsed = time.perf_counter() - start
+    world.close()
+    
+    return {
+        'seed': seed,
+        'frames': survived,
+        'coins': world.collected_coins,
+        'lives_lost': lives - world.lives,
+        'seconds': elapsed,
+        'fps': survived / elapsed if elapsed > 0 else float('inf'),
+        'digest': world.digest(),
+    }
+
+def run_batch(sessions, frames=BATCH_FRAMES, workers=None, seed=0, stage='default'):
+    # Sessions are independent, so they fan out over a process pool one per seed
+    workers = workers or os.cpu_count() or 1
+    seeds = range(seed, seed + sessions)
+    chunksize = max(1, sessions // (workers * 4))
+    
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        runs = list(pool.map(run_session, seeds, repeat(frames), repeat(stage), chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+    
+    total = sum(run['frames'] for run in runs)
+    cores = min(workers, os.cpu_count() or workers)
+    summary = {
+        'sessions': sessions,
+        'workers': workers,
+        'frames': total,
+        'seconds': elapsed,
+        'fps': total / elapsed if elapsed > 0 else float('inf'),
+        'fps_per_core': total / elapsed / cores if elapsed > 0 else float('inf'),
+        'coins': sum(run['coins'] for run in runs) / max(1, sessions),
+        'lives_lost': sum(run['lives_lost'] for run in runs) / max(1, sessions),
+        'survived': sum(run['frames'] == frames for run in runs),
+    }
+    return runs, summary
+
+def create_synthetic_stage(count, seed=0):
+    # A long procedurally generated stage with `count` platforms, coins and Goombas
+    rng = random.Random(seed)
+    palette = [LIGHT_BROWN, (200, 150, 100), (150, 200, 150), (180, 160, 130)]
+    platforms, coins, goombas = [], [], []
+    for i in range(count):
+        x = i * 150
+        y = GROUND_LEVEL - rng.choice((40, 80, 120, 160, 200))
+        kind = rng.random()
+        if kind < 0.05:
+            platforms.append(Platform(x, GROUND_LEVEL - 40, 80, 20, is_spike=True))
+        elif kind < 0.15:
+            platforms.append(Platform(x, y, 140, 20, is_cloud=True))
+        else:
+            platforms.append(Platform(x, y, rng.choice((70, 80, 100, 110, 120)), 20, rng.choice(palette)))
+        coins.append(Coin(x + 20, y - 30))
+        goombas.append(Goomba(x + 75, GROUND_LEVEL, rng.choice((60, 100, 150))))
+    return platforms, coins, goombas
+
+def time_loop(fn, setup, number):
+    # Mean seconds per call over number calls; with a setup step only the calls themselves are timed
+    if setup is None:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        return (time.perf_counter() - start) / number
+    elapsed = 0.0
+    for _ in range(number):
+        setup()
+        start = time.perf_counter()
+        fn()
+        elapsed += time.perf_counter() - start
+    return elapsed / number
+
+def calls_for(fn, setup, min_time):
+    # Doubles the call count until a loop lasts min_time, the way timeit.autorange does
+    number = 1
+    while time_loop(fn, setup, number) * number < min_time:
+        number *= 2
+    return number
+
+def time_cases(cases, repeats, min_time=BENCH_MIN_TIME):
+    # Each sample loops a case long enough to average out timer resolution. Samples are taken in
+    # rounds over all the cases rather than case by case, so a slow stretch on the machine lands on
+    # every case alike. Like timeit, the garbage collector is paused while timing. Returns every
+    # case's samples in ms per call
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        numbers = {name: calls_for(fn, setup, min_time) for name, (fn, setup) in cases.items()}
+        samples = {name: [] for name in cases}
+        for _ in range(repeats):
+            for name, (fn, setup) in cases.items():
+                samples[name].append(time_loop(fn, setup, numbers[name]) * 1000)
+    finally:
+        if collecting:
+            gc.enable()
+    return samples
+
+def run_benchmarks(sizes=BENCH_SIZES, repeats=5):
+    surface = pygame.Surface((WIDTH, HEIGHT))
+    cases = {}
+    
+    for count in sizes:
+        platforms, coins, goombas = create_synthetic_stage(count)
+        index = index_platforms(platforms)
+        koops = Koops(400, GROUND_LEVEL - 100, random.Random(0))
+        goomba_batch = GoombaBatch(goombas)
+        coin_batch = CoinBatch(coins)
+        
+        def koops_update(koops=koops, index=index):
+            koops.move(1, index)
+            koops.update(index, 0)
+            
+        def koops_respawn(koops=koops):
+            # Every call takes the same step from the spawn point, however many calls a sample makes
+            koops.position.set(400, GROUND_LEVEL - 100)
+            koops.previous_position.set(400, GROUND_LEVEL - 100)
+            koops.velocity_y = 0
+            
+        def goombas_update(goombas=goombas):
+            for goomba in goombas:
+                goomba.update(0)
+                
+        def coins_update(coins=coins):
+            for coin in coins:
+                coin.update(0)
+                
+        def platforms_draw(platforms=platforms):
+            for platform in platforms:
+                platform.draw(surface, 0)
+                
+        def coins_draw(coins=coins):
+            for coin in coins:
+                coin.draw(surface, 0)
+                
+        def goombas_draw(goombas=goombas):
+            for goomba in goombas:
+                goomba.draw(surface, 0)
+                
+        particles = ParticleSystem(capacity=count, seed=0)
+        
+        def particles_burst(particles=particles, count=count):
+            particles.count = 0
+            particles.add_particles(Point(WIDTH//2, HEIGHT//2), count, YELLOW, (-6, 6), (-8, 2), 60)
+            
+        sized = lambda name, count=count: f"{name}@{count}"
+        cases.update({
+            sized('platform.index'): (lambda platforms=platforms: index_platforms(platforms), None),
+            sized('koops.update'): (koops_update, koops_respawn),
+            sized('koops.draw'): (lambda koops=koops: koops.draw(surface), None),
+            sized('goomba.update'): (goombas_update, None),
+            sized('goomba.batch_update'): (lambda batch=goomba_batch: batch.update(0), None),
+            sized('goomba.draw'): (goombas_draw, None),
+            sized('coin.update'): (coins_update, None),
+            sized('coin.batch_update'): (lambda batch=coin_batch: batch.update(0), None),
+            sized('coin.draw'): (coins_draw, None),
+            sized('platform.draw'): (platforms_draw, None),
+            sized('particles.add'): (particles_burst, None),
+            sized('particles.update'): (particles.update, particles_burst),
+            sized('particles.draw'): (lambda particles=particles: particles.draw(surface, 0), particles_burst),
+        })
+    
+    text = "KOOP THE KOOPA"
+    
+    def text_uncached():
+        VectorFont.text_cache.clear()
+        VectorFont.glyph_cache.clear()
+        VectorFont.render_text(surface, text, 10, 10, 26, YELLOW)
+        
+    cases['vectorfont.render_cold'] = (text_uncached, None)
+    cases['vectorfont.render_cached'] = (lambda: VectorFont.render_text(surface, text, 10, 10, 26, YELLOW), None)
+    return time_cases(cases, repeats)
+
+def benchmark_report(samples):
+    # Each case reports its fastest sample, and the spread of its samples as a measure of its noise
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': host_platform.python_version(),
+            'pygame': pygame.version.ver,
+            'numpy': np.__version__,
+            'machine': host_platform.platform(),
+            'unit': 'ms',
+            'min_time': BENCH_MIN_TIME,
+        },
+        'results': {name: min(times) for name, times in samples.items()},
+        'spread': {name: max(times) - min(times) for name, times in samples.items()},
+    }
+
+def compare_benchmarks(results, baseline, tolerance=BENCH_TOLERANCE, spread=None, noise_floor=BENCH_NOISE_FLOOR):
+    # A case only regresses when it is slower by more than `tolerance` and by more than its baseline
+    # samples varied among themselves; baselines without a spread fall back to the fixed noise floor
+    spread = spread or {}
+    regressions = []
+    lines = [f"{'benchmark':<32}{'base ms':>11}{'noise':>9}{'new ms':>11}{'ratio':>8}"]
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            lines.append(f"{name:<32}{'-':>11}{'-':>9}{value:>11.3f}{'new':>8}")
+            continue
+        ratio = value / base if base > 0 else float('inf')
+        noise = max(noise_floor, spread.get(name, 0.0))
+        flag = ""
+        if ratio > 1 + tolerance and value - base > noise:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        lines.append(f"{name:<32}{base:>11.3f}{noise:>9.3f}{value:>11.3f}{ratio:>8.2f}{flag}")
+    return regressions, "\n".join(lines)
+
+DISPLAY_CAPTION = "Paper Mario: Thousand-Year Door Engine"
+
+def init_display(gpu=False):
+    # With gpu, returns the texture renderer and the surface its software scenes are drawn on
+    pygame.init()
+    if gpu:
+        textures = TextureRenderer.create(DISPLAY_CAPTION)
+        if textures is not None:
+            return textures.frame, textures
+        print("no accelerated renderer available, drawing in software")
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption(DISPLAY_CAPTION)
+    return screen, None
+
+MENU_OPTIONS_RECT = (WIDTH//2 - 115, HEIGHT//2 + 90, 230, 160)
+
+def main(dirty_rects=False, fps=FPS, seed=None, record=None, replay=None,
+         profile=False, profile_out=None, stage=None,
+         render_scale=1.0, render_filter='nearest', auto_scale=False, gpu=False):
+    screen, textures = init_display(gpu)
+    if textures is not None:
+        # The GPU scales the whole frame to the window, so the render scale does not apply
+        render_scale, auto_scale = 1.0, False
+    target = RenderTarget(screen, render_scale, render_filter == 'smooth', auto_scale, fps)
     game_state = GameState.MENU
     menu_selection = 0
+    drawn_selection = None
     boot_progress = 0
+    loader = None
     
-    platforms, coins, goombas = create_stage()
-    koops = Koops(400, GROUND_LEVEL - 100)
+    if replay is not None:
+        seed = replay.seed
+    elif record is not None and seed is None:
+        seed = random.randrange(2**31)
+    stage = replay.replay_stage(stage) if replay is not None else stage or 'default'
+    world = World(seed, stage)
+    recording = InputRecording(seed, stage=stage) if record is not None else None
+    profiler = world.profiler
+    profiler.enabled = profiler.visible = profile
+    restart_pending = False
+    replay_tick = 0
     
-    camera = Camera()
-    dialog = DialogBox("JUMP ON ENEMIES TO DEFEAT THEM! WATCH OUT FOR SPIKES!", 
-                      WIDTH//2 - 250, 100, 500, 80)
+    # A replay skips the menu and drives the world from the recording until it runs out
+    if replay is not None:
+        game_state = GameState.GAMEPLAY
+        world.dialog.open_box()
     
-    particle_system = ParticleSystem()
-    
-    collected_coins = 0
-    lives = 3
     clock = pygame.time.Clock()
+    renderer = DirtyRectRenderer(dirty_rects)
+    accumulator = 0.0
+    drawn_camera_x = None
+    jump_requested = False
+    crouching = False
+    running_held = False
     
     running = True
     while running:
-        dt = clock.tick(FPS) / 1000.0
+        dt = min(clock.tick(fps) / 1000.0, MAX_FRAME_TIME)
+        frame_start = time.perf_counter()
+        profiler.begin_frame()
         
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
             
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler.toggle()
+                renderer.invalidate()
+            
             elif event.type == pygame.KEYDOWN:
                 if game_state == GameState.MENU:
                     if event.key == pygame.K_DOWN:
@@ -820,133 +2953,269 @@ def main():
                     elif event.key == pygame.K_RETURN:
                         if menu_selection == 0:
                             game_state = GameState.BOOT
+                            loader = AssetLoader(world, screen.get_size())
                             boot_progress = 0
                         elif menu_selection == 2:
                             running = False
                 
                 elif game_state == GameState.GAMEPLAY:
                     if event.key in (pygame.K_SPACE, pygame.K_w):
-                        koops.jump()
+                        jump_requested = True
+                    elif event.key == pygame.K_RETURN:
+                        world.dialog.advance()
                     elif event.key == pygame.K_s:
-                        koops.crouch(True)
+                        crouching = True
                     elif event.key == pygame.K_LSHIFT:
-                        koops.run(True)
+                        running_held = True
                 
-                elif game_state == GameState.GAME_OVER and event.key == pygame.K_r:
-                    platforms, coins, goombas = create_stage()
-                    koops = Koops(400, GROUND_LEVEL - 100)
-                    collected_coins = 0
-                    lives = 3
+                elif game_state == GameState.GAME_OVER and event.key == pygame.K_r and replay is None:
+                    world.reset()
+                    crouching = running_held = False
+                    restart_pending = True
                     game_state = GameState.GAMEPLAY
             
             elif event.type == pygame.KEYUP and game_state == GameState.GAMEPLAY:
                 if event.key == pygame.K_s:
-                    koops.crouch(False)
+                    crouching = False
                 elif event.key == pygame.K_LSHIFT:
-                    koops.run(False)
+                    running_held = False
         
+        scene = game_state
         if game_state == GameState.MENU:
-            draw_main_menu(screen, menu_selection)
+            # With dirty rects the menu is only repainted when the selection moves
+            if not renderer.enabled or renderer.scene != scene or menu_selection != drawn_selection:
+                draw_main_menu(screen, menu_selection)
+                renderer.mark(MENU_OPTIONS_RECT)
+                drawn_selection = menu_selection
         
         elif game_state == GameState.BOOT:
-            boot_progress += 0.02
-            if boot_progress >= 1.0:
+            boot_progress = loader.poll()
+            if loader.finished:
+                loader = None
                 game_state = GameState.GAMEPLAY
-                dialog.open_box()
+                world.dialog.open_box()
+                accumulator = 0.0
             draw_boot_screen(screen, boot_progress)
+            renderer.invalidate()
         
         elif game_state in (GameState.GAMEPLAY, GameState.GAME_OVER):
-            camera.update(koops.position.x)
-            
-            screen.fill(BACKGROUND)
-            draw_background(screen, camera.offset)
-            
             keys = pygame.key.get_pressed()
             dx = keys[pygame.K_d] - keys[pygame.K_a]
-            koops.move(dx, platforms)
-            
-            koops.update(platforms)
-            dialog.update()
-            particle_system.update()
-            
-            for coin in coins:
-                coin.update()
-                if not coin.collected:
-                    dist = math.sqrt((koops.position.x - coin.position.x)**2 + 
-                                    (koops.position.y - coin.position.y)**2)
-                    if dist < 30:
-                        coin.collected = True
-                        collected_coins += 1
-                        particle_system.add_particles(coin.position, 10, YELLOW)
-            
-            for goomba in goombas:
-                goomba.update()
-                if not goomba.crushed:
-                    if (koops.position.x + koops.size.width > goomba.position.x + 5 and 
-                        koops.position.x < goomba.position.x + goomba.size.width - 5 and
-                        koops.position.y + koops.size.height - 5 > goomba.position.y and
-                        koops.position.y < goomba.position.y + goomba.size.height):
-                        
-                        if koops.position.y + koops.size.height < goomba.position.y + 10 and koops.velocity_y > 0:
-                            goomba.crushed = True
-                            koops.velocity_y = -JUMP_POWER * 0.7
-                            particle_system.add_particles(goomba.position, 15, BROWN)
-                        elif koops.invincible == 0:
-                            koops.damage()
-            
-            for platform in platforms:
-                if platform.is_spike:
-                    if (koops.position.x + koops.size.width > platform.position.x and 
-                        koops.position.x < platform.position.x + platform.size.width and
-                        koops.position.y + koops.size.height > platform.position.y and
-                        koops.position.y < platform.position.y + platform.size.height):
-                        koops.damage()
-                        koops.velocity_y = -8
-                        if koops.position.x < platform.position.x + platform.size.width//2:
-                            koops.position = Point(platform.position.x - koops.size.width - 5, koops.position.y)
-                        else:
-                            koops.position = Point(platform.position.x + platform.size.width + 5, koops.position.y)
-                        particle_system.add_particles(koops.position, 15, RED, (-3, 3), (-5, -3), 25)
-            
-            draw_ground(screen, camera.offset)
-            
-            for platform in platforms:
-                platform.draw(screen, camera.offset)
+            profiler.lap('input')
             
-            for coin in coins:
-                coin.draw(screen, camera.offset)
-            
-            for goomba in goombas:
-                goomba.draw(screen, camera.offset)
+            # Advance the simulation in fixed steps; a stalled frame catches up
+            # with at most MAX_STEPS_PER_FRAME steps and drops the remainder
+            accumulator += dt
+            steps = 0
+            while accumulator >= SIM_STEP and steps < MAX_STEPS_PER_FRAME:
+                if replay is not None:
+                    if replay_tick >= len(replay):
+                        running = False
+                        break
+                    controls, restart = replay.controls(replay_tick)
+                    replay_tick += 1
+                    if restart:
+                        world.reset()
+                        game_state = GameState.GAMEPLAY
+                else:
+                    controls = Controls(dx, jump_requested, crouching, running_held)
+                    jump_requested = False
+                if recording is not None:
+                    recording.record(controls, restart_pending)
+                    restart_pending = False
+                world.step(controls)
+                accumulator -= SIM_STEP
+                steps += 1
+            if steps == MAX_STEPS_PER_FRAME:
+                accumulator = min(accumulator, SIM_STEP)
+            alpha = accumulator / SIM_STEP
             
-            koops.draw(screen)
-            particle_system.draw(screen, camera.offset)
-            draw_ui(screen, collected_coins, lives)
-            dialog.draw(screen)
+            camera_x = int(world.camera.interpolated(alpha))
+            if camera_x != drawn_camera_x:
+                renderer.invalidate()
+                drawn_camera_x = camera_x
             
-            if koops.hit_points <= 0:
-                lives -= 1
-                koops.hit_points = 3
-                koops.position = Point(camera.offset + WIDTH//2, GROUND_LEVEL - 100)
-                koops.velocity_y = 0
+            if textures is not None:
+                textures.begin()
+                world.draw_textures(textures, alpha)
+            else:
+                renderer.mark(*world.draw(target.surface, alpha))
+                if target.scaled:
+                    # A scaled frame is always presented whole; dirty rects apply at full resolution only
+                    target.present()
+                    renderer.invalidate()
+            profiler.lap('upscale')
             
-            if lives <= 0:
+            if world.lives <= 0:
+                if game_state != GameState.GAME_OVER:
+                    renderer.invalidate()
                 game_state = GameState.GAME_OVER
-                overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-                overlay.fill((0, 0, 0, 150))
-                screen.blit(overlay, (0, 0))
-                
-                VectorFont.render_text(screen, "GAME OVER", 
-                                    WIDTH//2 - 100, HEIGHT//2 - 50, 
-                                    50, RED, WHITE, 5)
-                VectorFont.render_text(screen, "PRESS R TO RESTART", 
-                                    WIDTH//2 - 140, HEIGHT//2 + 30, 
-                                    28, YELLOW)
+                draw_game_over(screen if textures is None else textures)
+            profiler.lap('ui')
+            
+            culling = world.culling if scene == GameState.GAMEPLAY else None
+            if textures is not None:
+                textures.overlay.draw(lambda surface: profiler.draw(surface, culling))
+            else:
+                renderer.mark(profiler.draw(screen, culling))
+            profiler.lap('overlay')
         
-        pygame.display.flip()
-
+        if textures is None:
+            renderer.present(scene)
+        elif scene in (GameState.GAMEPLAY, GameState.GAME_OVER):
+            textures.present()
+        else:
+            textures.present_surface(screen)
+        profiler.lap('present')
+        profiler.end_frame(commit=scene in (GameState.GAMEPLAY, GameState.GAME_OVER))
+        if scene == GameState.GAMEPLAY:
+            target.adapt(time.perf_counter() - frame_start)
+    
+    if recording is not None:
+        recording.save(record)
+    if replay is not None:
+        print(f"replayed {replay_tick} ticks, digest={world.digest()}")
+    if target.changes:
+        print(f"render scale changed {target.changes} times, ended at {target.scale:g}")
+    if profiler.filled:
+        print(profiler.report(world.culling))
+        if profile_out is not None:
+            with open(profile_out, 'w') as f:
+                json.dump({'frames': profiler.filled, 'stages': profiler.percentiles(),
+                           'culling': {kind: {'drawn': visible, 'culled': culled}
+                                       for kind, (visible, culled) in world.culling.items()}}, f, indent=2)
+    if loader is not None:
+        # Boot workers may still be decoding chunks out of the level file
+        loader.pool.shutdown(wait=True, cancel_futures=True)
+    world.close()
     pygame.quit()
     sys.exit()
 
+def parse_render_scale(text):
+    try:
+        if "x" in text:
+            width, height = (int(value) for value in text.lower().split("x"))
+            scale = min(width / WIDTH, height / HEIGHT)
+        else:
+            scale = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a fraction or WxH, got {text!r}")
+    # Snap to the whole-pixel width the target will actually have
+    width = round(WIDTH * scale)
+    if not 0 < scale <= 1 or width < 1 or round(HEIGHT * scale) < 1:
+        raise argparse.ArgumentTypeError(f"render scale must be in (0, 1], got {text!r}")
+    return width / WIDTH
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Koopa Engine 1.0")
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help="only present changed screen regions when the camera is still")
+    parser.add_argument('--fps', type=int, default=FPS,
+                        help="render frame rate cap; the simulation always runs at %d Hz" % SIM_RATE)
+    parser.add_argument('--headless', type=int, metavar='FRAMES',
+                        help="step the simulation for FRAMES ticks with scripted input and no window")
+    parser.add_argument('--seed', type=int, help="random seed for the simulation")
+    parser.add_argument('--batch', type=int, metavar='SESSIONS',
+                        help="play SESSIONS seeded headless sessions of --headless frames "
+                             f"(default {BATCH_FRAMES}) over a process pool")
+    parser.add_argument('--workers', type=int, help="processes for --batch (default: one per core)")
+    parser.add_argument('--batch-out', metavar='FILE', help="write --batch outcomes and throughput to FILE as JSON")
+    parser.add_argument('--stage',
+                        help="stage to play: 'default', 'endless' (procedural chunks forever) "
+                             "or the path of a level file; a --replay uses the stage it was recorded on")
+    parser.add_argument('--export-level', metavar='FILE',
+                        help="write the --stage level to FILE in the binary level format and exit")
+    parser.add_argument('--export-chunks', type=int, metavar='N',
+                        help="number of chunks to export from a stage with no end")
+    parser.add_argument('--record', metavar='FILE',
+                        help="save the seed and every tick's input to FILE")
+    parser.add_argument('--replay', metavar='FILE',
+                        help="replay a recording without a window (add --show to watch it)")
+    parser.add_argument('--show', action='store_true',
+                        help="with --replay, play the recording back through the game window")
+    parser.add_argument('--render-scale', type=parse_render_scale, default=1.0, metavar='SCALE|WxH',
+                        help="draw gameplay at a fraction of the window resolution (e.g. 0.5) or at a "
+                             "fixed resolution (e.g. 320x200, fitted to the window's aspect) and upscale it")
+    parser.add_argument('--render-filter', choices=('nearest', 'smooth'), default='nearest',
+                        help="filter used to upscale a reduced render scale")
+    parser.add_argument('--auto-scale', action='store_true',
+                        help="lower the render scale while frames run over budget, and raise it "
+                             "back towards --render-scale when there is headroom")
+    parser.add_argument('--gpu', action='store_true',
+                        help="draw gameplay as textures through an accelerated SDL renderer, in a resizable "
+                             "window; falls back to software drawing when no such renderer exists")
+    parser.add_argument('--profile', action='store_true',
+                        help="start with the frame-time overlay on (F3 toggles it)")
+    parser.add_argument('--profile-out', metavar='FILE',
+                        help="write per-stage p50/p95/p99 frame times to FILE as JSON on exit")
+    parser.add_argument('--bench', metavar='FILE',
+                        help="run the stress benchmarks offscreen and write the results to FILE as JSON")
+    parser.add_argument('--bench-baseline', metavar='FILE',
+                        help="compare --bench results against an earlier results FILE and flag regressions")
+    parser.add_argument('--bench-tolerance', type=float, default=BENCH_TOLERANCE,
+                        help="slowdown ratio over --bench-baseline that counts as a regression "
+                             f"(default {BENCH_TOLERANCE}); raise it on shared or throttled runners")
+    parser.add_argument('--bench-sizes', default=",".join(map(str, BENCH_SIZES)),
+                        help="comma-separated entity counts for the synthetic stages")
+    args = parser.parse_args(argv)
+    if args.export_level is not None and args.export_chunks is None and args.stage == 'endless':
+        parser.error("--stage endless has no end; pass --export-chunks N to export its first N chunks")
+    if args.stage is None and args.replay is None:
+        args.stage = 'default'
+    return args
+
+def format_stats(stats):
+    return " ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in stats.items())
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.export_level is not None:
+        level = create_level(args.stage, args.seed)
+        chunk_range = range(args.export_chunks) if args.export_chunks is not None else None
+        LevelFile.write(args.export_level, level, chunk_range)
+        level.close()
+    elif args.batch is not None:
+        frames = args.headless if args.headless is not None else BATCH_FRAMES
+        runs, summary = run_batch(args.batch, frames, args.workers, args.seed or 0, args.stage)
+        for run in runs:
+            print(format_stats(run))
+        print(format_stats(summary))
+        if args.batch_out is not None:
+            with open(args.batch_out, 'w') as f:
+                json.dump({'summary': summary, 'runs': runs}, f, indent=2)
+    elif args.bench is not None:
+        sizes = [int(size) for size in args.bench_sizes.split(",")]
+        report = benchmark_report(run_benchmarks(sizes))
+        with open(args.bench, 'w') as f:
+            json.dump(report, f, indent=2)
+        if args.bench_baseline is not None:
+            with open(args.bench_baseline) as f:
+                baseline = json.load(f)
+            regressions, table = compare_benchmarks(report['results'], baseline['results'], args.bench_tolerance,
+                                                    baseline.get('spread'))
+            print(table)
+            if regressions:
+                sys.exit(f"{len(regressions)} benchmark(s) regressed by more than {args.bench_tolerance:.0%} "
+                         "and by more than the baseline's own spread")
+        else:
+            print(format_stats(report['results']))
+    elif args.replay is not None and not args.show:
+        print(format_stats(replay_headless(InputRecording.load(args.replay), args.stage)))
+    elif args.headless is not None:
+        recording = None
+        if args.record is not None:
+            seed = args.seed if args.seed is not None else random.randrange(2**31)
+            recording = InputRecording(seed, stage=args.stage)
+            args.seed = seed
+        print(format_stats(run_headless(args.headless, seed=args.seed, recording=recording,
+                                        stage=args.stage)))
+        if recording is not None:
+            recording.save(args.record)
+    else:
+        replay = InputRecording.load(args.replay) if args.replay is not None else None
+        main(dirty_rects=args.dirty_rects, fps=args.fps, seed=args.seed,
+             record=args.record, replay=replay,
+             profile=args.profile, profile_out=args.profile_out, stage=args.stage,
+             render_scale=args.render_scale, render_filter=args.render_filter, auto_scale=args.auto_scale,
+             gpu=args.gpu)